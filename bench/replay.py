@@ -0,0 +1,240 @@
+# ================= BENCH / REPLAY DO PIPELINE DE PLACAR =================
+# Reproduz sequências de placares da ESPN (gravadas ou sintéticas) contra o pipeline real do bot:
+# fetch_espn_soccer (com o cache condicional), motor de eventos, green/red, parse_odds_string e os cards.
+# A ESPN é trocada por um httpx.MockTransport e o Telegram por um bot falso que só guarda as mensagens.
+#
+#   python bench/replay.py                          # replay do fixture + confere as mensagens esperadas
+#   python bench/replay.py --synthetic 500          # dia sintético com 500 jogos simultâneos
+#   python bench/replay.py --max-p95-ms 50          # falha (exit 1) se o p95 por iteração passar disso
+#   python bench/replay.py --record                 # regrava o .expected.json do fixture
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import contextlib
+import io
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+sys.path.insert(0, str(ROOT))
+
+# Sem limites de envio nem estado persistente de verdade durante o bench
+TMP_DIR = tempfile.mkdtemp(prefix="bench_")
+os.environ.update({
+    "BOT_TOKEN": "bench", "CHANNEL_ID": "bench", "STATE_DB": os.path.join(TMP_DIR, "state.db"),
+    "TG_GLOBAL_RATE": "1000000", "TG_CHAT_RATE": "1000000", "TG_CHAT_BURST": "1000000",
+    "SEND_QUEUE_MAX": "1000000",
+})
+
+import httpx
+import bot
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        # Mensagens agrupadas pela fila voltam a ser contadas uma a uma
+        self.messages.extend(text.split(bot.COALESCE_SEP))
+
+class FakeEspn:
+    # Serve o frame atual: {codigo_liga: scoreboard_json}; liga fora do frame = placar vazio
+    def __init__(self):
+        self.frame = {}
+        self.bodies = {}
+        self.requests = 0
+
+    def load(self, frame):
+        self.frame = frame
+        self.bodies = {code: json.dumps(data).encode() for code, data in frame.items()}
+
+    def handler(self, request):
+        self.requests += 1
+        code = request.url.path.split("/soccer/")[-1].split("/")[0]
+        return httpx.Response(200, content=self.bodies.get(code, b'{"events": []}'))
+
+def reset_bot(espn, fake_bot):
+    bot.TODAYS_GAMES = []
+    bot.ALERT_MEMORY = {}
+    bot.DAILY_STATS = {"date": bot.get_api_date_str(), "green": 0, "red": 0}
+    bot.SOCCER_DATE = ""
+    bot.ACTIVE_LEAGUES = set()
+    bot.DISCOVERY = {"date": "", "at": 0.0}
+    bot.LAST_PRUNE = time.time()
+    for registry in (bot.RESPONSE_CACHE, bot.CACHE_STATS, bot.LEAGUE_VERSIONS, bot.POLL_SCHEDULE, bot.EVENTS_EMITTED):
+        registry.clear()
+    bot.HTTP_CLIENT = httpx.AsyncClient(transport=httpx.MockTransport(espn.handler))
+    bot.STORE = bot.StateStore(os.path.join(TMP_DIR, f"state_{time.monotonic_ns()}.db"))
+    bot.STORE.open()
+    bot.REGISTRY = bot.SubscriptionRegistry()
+    bot.REGISTRY.set(bot.Subscriber(bot.CHANNEL_ID, frozenset(), {}))
+    bot.OUTBOX = bot.OutboundQueue(bot.SEND_QUEUE_MAX, bot.SEND_WORKERS)
+    bot.OUTBOX.start(fake_bot)
+
+# --- FIXTURES SINTÉTICOS (mesmo formato do scoreboard da ESPN) ---
+
+def espn_event(gid, kickoff, home, away, state, detail, score_home, score_away, odds):
+    return {
+        "id": str(gid), "date": kickoff,
+        "status": {"type": {"state": state, "detail": detail}},
+        "competitions": [{
+            "competitors": [
+                {"team": {"name": home}, "score": str(score_home)},
+                {"team": {"name": away}, "score": str(score_away)},
+            ],
+            "venue": {"fullName": f"Estádio {home}"},
+            "odds": [{"details": odds}] if odds else [],
+        }],
+    }
+
+def synthetic_day(n_games, n_frames, seed=337):
+    # Todos os jogos começam juntos e andam 90' ao longo dos frames; o último frame encerra tudo
+    rng = random.Random(seed)
+    leagues = list(bot.SOCCER_LEAGUES)
+    games = []
+    for i in range(n_games):
+        home, away = f"Casa{i:04d}", f"Fora{i:04d}"
+        fav = home if rng.random() < 0.6 else away
+        odds = f"{fav[:4].upper()} -{rng.randint(110, 300)}"
+        games.append({"id": 900000 + i, "league": leagues[i % len(leagues)], "home": home, "away": away, "odds": odds, "h": 0, "a": 0})
+
+    frames = []
+    for f in range(n_frames):
+        minute = int(90 * f / max(1, n_frames - 2))
+        last = f == n_frames - 1
+        frame = {code: {"events": []} for code in leagues}
+        for g in games:
+            if 0 < f and not last and rng.random() < 0.04: g["h"] += 1
+            if 0 < f and not last and rng.random() < 0.03: g["a"] += 1
+            state = "pre" if f == 0 else ("post" if last else "in")
+            detail = "FT" if last else (f"{minute}'" if f else "15:00")
+            frame[g["league"]]["events"].append(espn_event(g["id"], "2026-10-18T18:00Z", g["home"], g["away"], state, detail, g["h"], g["a"], g["odds"]))
+        frames.append(frame)
+    return frames
+
+# --- REPLAY ---
+
+async def replay(frames, track_memory=False):
+    espn = FakeEspn(); fake_bot = FakeBot()
+    reset_bot(espn, fake_bot)
+    processed = {}
+    latencies = []
+    games_seen = 0
+    if track_memory: tracemalloc.start()
+
+    # Os prints do bot ([RESULTADO] etc.) não entram no relatório
+    with contextlib.redirect_stdout(io.StringIO()):
+        for frame in frames:
+            espn.load(frame)
+            t0 = time.perf_counter()
+            await bot.poll_cycle(processed, due=list(frame))
+            latencies.append(time.perf_counter() - t0)
+            games_seen += sum(len(data.get("events", [])) for data in frame.values())
+            await bot.OUTBOX.join()
+
+    peak = tracemalloc.get_traced_memory()[1] if track_memory else 0
+    if track_memory: tracemalloc.stop()
+    await bot.OUTBOX.stop()
+    await bot.close_http_client()
+    bot.STORE.close()
+    return {
+        "messages": fake_bot.messages, "latencies": latencies, "games_seen": games_seen,
+        "peak_bytes": peak, "requests": espn.requests,
+        "stats": dict(bot.DAILY_STATS), "events": dict(bot.EVENTS_EMITTED),
+        "cache": {"hit": sum(v["hit"] for v in bot.CACHE_STATS.values()), "miss": sum(v["miss"] for v in bot.CACHE_STATS.values())},
+    }
+
+def micro_benchmarks(rounds=2000):
+    # Hot paths isolados sobre a grade que ficou em TODAYS_GAMES depois do replay
+    results = {}
+    samples = [("FLA -150", "Flamengo", "Vasco"), ("SAN +130", "Palmeiras", "Santos"), ("EVEN", "A", "B"), ("-", "A", "B")]
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for details, home, away in samples: bot.parse_odds_string(details, home, away)
+    results["parse_odds_string/s"] = rounds * len(samples) / (time.perf_counter() - t0)
+
+    games = bot.TODAYS_GAMES
+    if games:
+        t0 = time.perf_counter()
+        for _ in range(max(1, rounds // len(games))):
+            for g in games: bot.format_card(g)
+        results["format_card/s"] = max(1, rounds // len(games)) * len(games) / (time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        bot.RENDER_CACHE.clear()
+        pages = bot.rendered_pages("fut", "bench\n")
+        results["render_grid_ms"] = (time.perf_counter() - t0) * 1000
+        results["grid_pages"] = len(pages)
+    return results
+
+def pct(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def report(name, timing, memory, micro):
+    lat_ms = [x * 1000 for x in timing["latencies"]]
+    total = sum(timing["latencies"])
+    print(f"\n📊 {name}")
+    print(f"   frames: {len(lat_ms)} | jogos processados: {timing['games_seen']} | requisições ESPN: {timing['requests']} (cache {timing['cache']})")
+    print(f"   throughput: {timing['games_seen'] / total:,.0f} jogos/s")
+    print(f"   latência por iteração: p50 {pct(lat_ms, 50):.2f} ms | p95 {pct(lat_ms, 95):.2f} ms | máx {max(lat_ms):.2f} ms")
+    print(f"   pico de memória (tracemalloc): {memory['peak_bytes'] / 1024 / 1024:.2f} MiB")
+    print(f"   eventos: {timing['events']} | mensagens: {len(timing['messages'])} | cofre: {timing['stats']['green']}G/{timing['stats']['red']}R")
+    for key, value in micro.items():
+        print(f"   {key}: {value:,.2f}" if isinstance(value, float) else f"   {key}: {value:,}")
+    return pct(lat_ms, 95)
+
+async def run_scenario(name, frames):
+    timing = await replay(frames)
+    micro = micro_benchmarks()
+    memory = await replay(frames, track_memory=True)
+    return timing, report(name, timing, memory, micro)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay/benchmark do pipeline de placar com fixtures da ESPN")
+    parser.add_argument("--fixture", default=str(FIXTURES / "matchday.json"))
+    parser.add_argument("--synthetic", type=int, default=0, help="também roda um dia sintético com N jogos simultâneos")
+    parser.add_argument("--frames", type=int, default=20, help="frames do dia sintético")
+    parser.add_argument("--max-p95-ms", type=float, default=0, help="falha se o p95 por iteração passar disso")
+    parser.add_argument("--record", action="store_true", help="regrava as mensagens esperadas do fixture")
+    args = parser.parse_args()
+
+    failed = False
+    fixture = Path(args.fixture)
+    frames = json.loads(fixture.read_text(encoding="utf-8"))["frames"]
+    timing, p95 = await run_scenario(f"fixture {fixture.name}", frames)
+    expected_path = fixture.with_suffix(".expected.json")
+    if args.record:
+        expected_path.write_text(json.dumps(timing["messages"], ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"   ✍️ mensagens gravadas em {expected_path.name}")
+    elif expected_path.exists():
+        expected = json.loads(expected_path.read_text(encoding="utf-8"))
+        if timing["messages"] == expected:
+            print(f"   ✅ mensagens idênticas às esperadas ({len(expected)})")
+        else:
+            failed = True
+            print("   ❌ mensagens diferentes das esperadas:")
+            for i in range(max(len(expected), len(timing["messages"]))):
+                got = timing["messages"][i] if i < len(timing["messages"]) else None
+                want = expected[i] if i < len(expected) else None
+                if got != want: print(f"      #{i}\n      esperado: {want!r}\n      recebido: {got!r}")
+    if args.max_p95_ms and p95 > args.max_p95_ms: failed = True
+
+    if args.synthetic:
+        _, p95 = await run_scenario(f"sintético {args.synthetic} jogos x {args.frames} frames", synthetic_day(args.synthetic, args.frames))
+        if args.max_p95_ms and p95 > args.max_p95_ms:
+            failed = True
+            print(f"   ❌ p95 {p95:.2f} ms acima do limite de {args.max_p95_ms} ms")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    asyncio.run(main())
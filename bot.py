@@ -4,9 +4,21 @@ import logging
 import asyncio
 import threading
 import html
-import random
-from datetime import datetime, timezone, timedelta
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import hashlib
+import re
+import math
+import calendar
+import json
+import sqlite3
+import time
+import itertools
+import heapq
+import multiprocessing
+import multiprocessing.connection
+import zlib
+from collections import deque
+from dataclasses import dataclass, astuple
+from datetime import datetime, timezone, timedelta, time as dtime
 
 try:
     import httpx
@@ -14,6 +26,7 @@ try:
     from dotenv import load_dotenv
     from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
     from telegram.constants import ParseMode
+    from telegram.error import RetryAfter, BadRequest, Forbidden, NetworkError
     from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, Defaults
 except ImportError:
     print("❌ ERRO: Faltam bibliotecas. Instale: pip install python-telegram-bot httpx feedparser python-dotenv")
@@ -23,8 +36,84 @@ except ImportError:
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")
+# Canais/grupos extras (JSON): [{"chat_id": "-100...", "leagues": ["bra.1", "nba"], "times": {"grade_manha": "09:00"}}]
+SUBSCRIPTIONS = os.getenv("SUBSCRIPTIONS", "")
 PORT = int(os.getenv("PORT", 10000))
 
+# ESPN: requisições simultâneas e timeout por liga (ex: ESPN_LEAGUE_TIMEOUTS="bra.1=12,eng.1=6")
+ESPN_CONCURRENCY = int(os.getenv("ESPN_CONCURRENCY", 4))
+ESPN_TIMEOUT = float(os.getenv("ESPN_TIMEOUT", 8))
+ESPN_LEAGUE_TIMEOUTS = {
+    k.strip(): float(v) for k, v in
+    (item.split("=", 1) for item in os.getenv("ESPN_LEAGUE_TIMEOUTS", "").split(",") if "=" in item)
+}
+
+# Polling adaptativo (segundos): ao vivo, jogo perto de começar, teto para liga ociosa
+POLL_LIVE = int(os.getenv("POLL_LIVE", 15))
+POLL_SOON = int(os.getenv("POLL_SOON", 60))
+POLL_IDLE = int(os.getenv("POLL_IDLE", 1800))
+POLL_SOON_WINDOW = int(os.getenv("POLL_SOON_WINDOW", 1800))
+LOOP_TICK = 60
+
+# Catálogo de ligas: vazio = catálogo completo; senão "bra.1,eng.1,usa.1=🇺🇸 MLS" (nome opcional)
+LEAGUES = os.getenv("LEAGUES", "")
+# Descoberta: uma passada pelo catálogo inteiro por dia (refeita após esse intervalo) decide quais ligas entram no polling
+DISCOVERY_TTL = int(os.getenv("DISCOVERY_TTL", 6 * 3600))
+
+# Notícias: feeds RSS (separados por vírgula), intervalo do giro, quantas manchetes por giro,
+# idade máxima de uma notícia e por quanto tempo um GUID já postado fica no índice
+NEWS_FEEDS = [u.strip() for u in os.getenv("NEWS_FEEDS", ",".join([
+    "https://ge.globo.com/rss/ge/futebol/",
+    "https://ge.globo.com/rss/ge/futebol/futebol-internacional/",
+    "https://ge.globo.com/rss/ge/futebol/brasileirao-serie-a/",
+])).split(",") if u.strip()]
+NEWS_INTERVAL = int(os.getenv("NEWS_INTERVAL", 14400))
+NEWS_PER_POST = int(os.getenv("NEWS_PER_POST", 3))
+NEWS_MAX_AGE = int(os.getenv("NEWS_MAX_AGE", 86400))
+NEWS_SEEN_TTL = 30 * 86400
+NEWS_ENTRIES_PER_FEED = 30
+
+# Pollers em processos separados (0 = tudo no processo do bot). Cada worker cuida de um shard de ligas
+# e manda deltas pro bot, que é o único a rodar o motor de eventos e a falar com o Telegram.
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", 0))
+WORKER_HEARTBEAT = 5          # s entre heartbeats do worker
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", 60))   # sem heartbeat por esse tempo = worker travado
+# Heartbeat só prova que o event loop do worker vive; sem poll bem-sucedido além do maior intervalo da agenda
+# dele + essa folga, o worker é considerado sem progresso e reiniciado
+WORKER_STALL_GRACE = int(os.getenv("WORKER_STALL_GRACE", 300))
+
+# Broadcasts atrasados (ex: reinício do bot) ainda são enviados se estiverem dentro desta janela (s)
+BROADCAST_CATCHUP_GRACE = int(os.getenv("BROADCAST_CATCHUP_GRACE", 10800))
+
+# Estado persistente (SQLite/WAL): memória de alertas, cofre do dia e broadcasts enviados
+STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+ALERT_MEMORY_TTL = int(os.getenv("ALERT_MEMORY_TTL", 21600))   # jogo encerrado sai da memória após isso (s)
+ALERT_MEMORY_MAX_AGE = 172800                                    # qualquer jogo sem atualização há 48h sai também
+
+# Fila de envio Telegram: limite global (msg/s), limite por chat (msg/s + rajada), tamanho e workers
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", 1000))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 4))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 5))
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", 25))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", 20 / 60))
+TG_CHAT_BURST = int(os.getenv("TG_CHAT_BURST", 3))
+
+# Menu: intervalo mínimo entre cliques iguais no mesmo chat (s) e idade máxima dos dados servidos sem nova busca (s)
+MENU_COOLDOWN = float(os.getenv("MENU_COOLDOWN", 3))
+FETCH_FRESH_TTL = int(os.getenv("FETCH_FRESH_TTL", 60))
+# Bilhete de Ouro: faixa de odd por perna, janela máxima entre o 1º e o último jogo, intervalo mínimo entre jogos
+TICKET_MIN_ODD = float(os.getenv("TICKET_MIN_ODD", 1.20))
+TICKET_MAX_ODD = float(os.getenv("TICKET_MAX_ODD", 2.20))
+TICKET_WINDOW = int(os.getenv("TICKET_WINDOW", 12 * 3600))
+TICKET_MIN_GAP = int(os.getenv("TICKET_MIN_GAP", 0))
+TICKET_MAX_NODES = int(os.getenv("TICKET_MAX_NODES", 200000))
+TICKET_DEFAULT_TARGET = 4.00
+TICKET_DEFAULT_LEGS = 3
+
+# Health: /readyz falha se o último poll bem-sucedido for mais velho que isso (s) ou o loop atrasar mais que READY_MAX_LOOP_LAG (s)
+READY_MAX_POLL_AGE = int(os.getenv("READY_MAX_POLL_AGE", POLL_IDLE + 300))
+READY_MAX_LOOP_LAG = float(os.getenv("READY_MAX_LOOP_LAG", 1.0))
+
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -33,15 +122,48 @@ TODAYS_GAMES = []
 TODAYS_NBA = []
 TODAYS_UFC = []
 ALERT_MEMORY = {}
+LAST_PRUNE = 0.0
+
+# Telemetria (exposta em /metrics)
+FETCH_LATENCY = {}      # liga -> LatencyRecorder (busca HTTP)
+PARSE_LATENCY = {}      # liga -> LatencyRecorder (parse do JSON)
+FETCH_ERRORS = {}       # liga -> falhas
+EVENTS_EMITTED = {}     # tipo de evento -> total
+LAST_POLL_OK = 0.0      # time.time() da última liga buscada com sucesso
+LOOP_LAG = 0.0          # atraso do event loop medido pelo monitor (s)
+STARTED_AT = time.time()
+BACKGROUND_TASKS = {}   # nome -> asyncio.Task (loops de fundo)
+
+# Cliente HTTP único (pool de conexões) compartilhado por todos os motores de busca
+HTTP_CLIENT = None
+SUPERVISOR = None       # PollSupervisor quando POLL_WORKERS > 0
+
+# Cache de respostas ESPN por URL (ETag/Last-Modified + hash do corpo) e contadores hit/miss
+RESPONSE_CACHE = {}
+CACHE_STATS = {}
+RESPONSE_CACHE_MAX = 256
+
+# Agenda de polling por liga: {code: {"state": live|soon|idle, "interval": s, "next": datetime}}
+POLL_SCHEDULE = {}
+SOCCER_DATE = ""
+
+# Ligas com jogo hoje (só essas entram no polling) e quando a descoberta rodou
+ACTIVE_LEAGUES = set()
+DISCOVERY = {"date": "", "at": 0.0}
+
+# Versão do placar de cada liga: só muda quando o payload da ESPN muda (o motor de eventos só olha essas)
+LEAGUE_VERSIONS = {}
 
 # O COFRE: Guarda o placar de Greens e Reds do dia
 DAILY_STATS = {
     "date": "",
     "green": 0,
-    "red": 0,
-    "closed": False
+    "red": 0
 }
 
+# Broadcasts de horário fixo: {nome: data (YYYYMMDD) do último envio} -> no máximo um envio por dia
+BROADCASTS_SENT = {}
+
 # --- 2. HELPERS MATEMÁTICOS ---
 
 def american_to_decimal(american_str):
@@ -63,10 +185,210 @@ def get_display_date():
 def get_api_date_str():
     return get_real_server_date().strftime("%Y%m%d")
 
+# Faixas de odd do histórico (limite inferior, rótulo)
+ODD_BANDS = [(2.20, "2.20+"), (1.80, "1.80-2.19"), (1.50, "1.50-1.79"), (0.0, "<1.50")]
+
+def odd_band(odd):
+    return next(label for floor, label in ODD_BANDS if odd >= floor)
+
+def pick_profit(odd, green):
+    # Stake de 1 unidade na odd oferecida
+    return round(odd - 1, 4) if green else -1.0
+
 def safe_html(text):
     if not text: return ""
     return html.escape(str(text))
 
+class StateStore:
+    # Escritas acumuladas no loop e gravadas numa única transação por iteração (flush)
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+        self.dirty_games = set()
+        self.dirty_stats = False
+        self.pending_picks = []
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS alert_memory (gid TEXT PRIMARY KEY, state TEXT NOT NULL, status TEXT, updated REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS daily_stats (date TEXT PRIMARY KEY, green INTEGER NOT NULL, red INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS broadcasts (name TEXT PRIMARY KEY, date TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS subscriptions (chat_id TEXT PRIMARY KEY, leagues TEXT NOT NULL, times TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS news_seen (guid TEXT PRIMARY KEY, seen REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS league_discovery (date TEXT PRIMARY KEY, leagues TEXT NOT NULL, at REAL NOT NULL);
+            -- Histórico: uma linha por aposta liquidada + rollup diário (data, liga, faixa de odd) para consultas rápidas
+            CREATE TABLE IF NOT EXISTS picks (gid TEXT PRIMARY KEY, date TEXT NOT NULL, league TEXT NOT NULL, match TEXT NOT NULL,
+                                              pick TEXT NOT NULL, odd REAL NOT NULL, result TEXT NOT NULL, settled REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS pick_rollup (date TEXT NOT NULL, league TEXT NOT NULL, band TEXT NOT NULL,
+                                                    green INTEGER NOT NULL, red INTEGER NOT NULL, profit REAL NOT NULL,
+                                                    PRIMARY KEY (date, league, band));
+        """)
+
+    def close(self):
+        if self.conn is not None: self.conn.close(); self.conn = None
+
+    def load(self, today):
+        with self.lock:
+            memory = {gid: json.loads(state) for gid, state in self.conn.execute("SELECT gid, state FROM alert_memory")}
+            row = self.conn.execute("SELECT green, red FROM daily_stats WHERE date = ?", (today,)).fetchone()
+            sent = dict(self.conn.execute("SELECT name, date FROM broadcasts"))
+        stats = {"date": today, "green": row[0], "red": row[1]} if row else {"date": today, "green": 0, "red": 0}
+        return memory, stats, sent
+
+    def mark_game(self, gid): self.dirty_games.add(gid)
+    def mark_stats(self): self.dirty_stats = True
+    def record_pick(self, row): self.pending_picks.append(row)
+
+    async def flush(self, memory, stats):
+        if self.conn is None or not (self.dirty_games or self.dirty_stats or self.pending_picks): return
+        # Snapshot no event loop; gravação fora dele
+        upserts = [(gid, json.dumps(memory[gid]), memory[gid]['status'], memory[gid]['ts']) for gid in self.dirty_games if gid in memory]
+        deletes = [(gid,) for gid in self.dirty_games if gid not in memory]
+        stats_row = (stats['date'], stats['green'], stats['red']) if self.dirty_stats else None
+        picks, self.pending_picks = self.pending_picks, []
+        self.dirty_games = set(); self.dirty_stats = False
+        await asyncio.to_thread(self._write, upserts, deletes, stats_row, picks)
+
+    def _write(self, upserts, deletes, stats_row, picks=()):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO alert_memory (gid, state, status, updated) VALUES (?, ?, ?, ?)", upserts)
+                self.conn.executemany("DELETE FROM alert_memory WHERE gid = ?", deletes)
+                if stats_row: self.conn.execute("INSERT OR REPLACE INTO daily_stats (date, green, red) VALUES (?, ?, ?)", stats_row)
+                for gid, date, league, match, pick, odd, result, settled in picks:
+                    cur = self.conn.execute("INSERT OR IGNORE INTO picks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                            (gid, date, league, match, pick, odd, result, settled))
+                    if cur.rowcount != 1: continue  # já liquidada antes: não conta duas vezes no rollup
+                    green = result == "G"
+                    self.conn.execute("""
+                        INSERT INTO pick_rollup (date, league, band, green, red, profit) VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (date, league, band) DO UPDATE SET
+                            green = green + excluded.green, red = red + excluded.red, profit = profit + excluded.profit
+                    """, (date, league, odd_band(odd), int(green), int(not green), pick_profit(odd, green)))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK"); raise
+
+    async def save_broadcast(self, name, date):
+        if self.conn is None: return
+        def _save():
+            with self.lock: self.conn.execute("INSERT OR REPLACE INTO broadcasts (name, date) VALUES (?, ?)", (name, date))
+        await asyncio.to_thread(_save)
+
+    def unseen_news(self, guids):
+        with self.lock:
+            marks = ",".join("?" * len(guids))
+            seen = {row[0] for row in self.conn.execute(f"SELECT guid FROM news_seen WHERE guid IN ({marks})", guids)}
+        return [g for g in guids if g not in seen]
+
+    async def mark_news(self, guids, now):
+        if self.conn is None: return
+        def _save():
+            with self.lock:
+                self.conn.executemany("INSERT OR REPLACE INTO news_seen (guid, seen) VALUES (?, ?)", [(g, now) for g in guids])
+                # Índice limitado: GUID antigo nunca mais volta no feed
+                self.conn.execute("DELETE FROM news_seen WHERE seen < ?", (now - NEWS_SEEN_TTL,))
+        await asyncio.to_thread(_save)
+
+    def load_discovery(self, date):
+        with self.lock:
+            row = self.conn.execute("SELECT leagues, at FROM league_discovery WHERE date = ?", (date,)).fetchone()
+        return (set(json.loads(row[0])), row[1]) if row else None
+
+    async def save_discovery(self, date, leagues, at):
+        if self.conn is None: return
+        def _save():
+            with self.lock:
+                self.conn.execute("INSERT OR REPLACE INTO league_discovery (date, leagues, at) VALUES (?, ?, ?)", (date, json.dumps(sorted(leagues)), at))
+                self.conn.execute("DELETE FROM league_discovery WHERE date < ?", (date,))
+        await asyncio.to_thread(_save)
+
+    def pick_summary(self, since):
+        # Só lê o rollup (dias x ligas x faixas), nunca varre as apostas cruas
+        with self.lock:
+            by_league = self.conn.execute(
+                "SELECT league, SUM(green), SUM(red), SUM(profit) FROM pick_rollup WHERE date >= ? GROUP BY league", (since,)).fetchall()
+            by_band = self.conn.execute(
+                "SELECT band, SUM(green), SUM(red), SUM(profit) FROM pick_rollup WHERE date >= ? GROUP BY band", (since,)).fetchall()
+        return by_league, by_band
+
+    def day_tally(self, date, leagues):
+        marks = ",".join("?" * len(leagues))
+        with self.lock:
+            row = self.conn.execute(f"SELECT SUM(green), SUM(red) FROM pick_rollup WHERE date = ? AND league IN ({marks})",
+                                    (date, *sorted(leagues))).fetchone()
+        return row[0] or 0, row[1] or 0
+
+    def load_subscriptions(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT chat_id, leagues, times FROM subscriptions").fetchall()
+        return [(chat_id, json.loads(leagues), json.loads(times)) for chat_id, leagues, times in rows]
+
+    async def save_subscription(self, chat_id, leagues, times):
+        if self.conn is None: return
+        def _save():
+            with self.lock:
+                self.conn.execute("INSERT OR REPLACE INTO subscriptions (chat_id, leagues, times) VALUES (?, ?, ?)",
+                                  (chat_id, json.dumps(sorted(leagues)), json.dumps(times)))
+        await asyncio.to_thread(_save)
+
+    async def delete_subscription(self, chat_id):
+        if self.conn is None: return
+        def _delete():
+            with self.lock: self.conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+        await asyncio.to_thread(_delete)
+
+STORE = StateStore(STATE_DB)
+
+def prune_alert_memory(live_ids):
+    # Jogo encerrado que já saiu da grade (ou parado há 48h) não precisa mais de memória
+    now_ts = time.time()
+    for gid, entry in list(ALERT_MEMORY.items()):
+        age = now_ts - entry.get('ts', 0)
+        if (entry['status'] == 'post' and gid not in live_ids and age > ALERT_MEMORY_TTL) or age > ALERT_MEMORY_MAX_AGE:
+            del ALERT_MEMORY[gid]
+            STORE.mark_game(gid)
+
+class LatencyRecorder:
+    # Janela deslizante das últimas amostras (s) para percentis
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentiles(self, points=(50, 95, 99)):
+        if not self.samples: return {}
+        ordered = sorted(self.samples)
+        return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+def get_http_client():
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None or HTTP_CLIENT.is_closed:
+        HTTP_CLIENT = httpx.AsyncClient(
+            timeout=ESPN_TIMEOUT,
+            limits=httpx.Limits(max_connections=ESPN_CONCURRENCY * 2, max_keepalive_connections=ESPN_CONCURRENCY),
+        )
+    return HTTP_CLIENT
+
+async def close_http_client():
+    global HTTP_CLIENT
+    if HTTP_CLIENT is not None and not HTTP_CLIENT.is_closed:
+        await HTTP_CLIENT.aclose()
+    HTTP_CLIENT = None
+
+def league_timeout(code):
+    return ESPN_LEAGUE_TIMEOUTS.get(code, ESPN_TIMEOUT)
+
 # --- 3. PARSERS E FORMATADORES ---
 
 def parse_odds_string(details_str, home_name, away_name):
@@ -95,264 +417,1312 @@ def parse_odds_string(details_str, home_name, away_name):
     except: pass
     return pick, odd_decimal, icon, is_favorite
 
-def format_card(game, api_raw):
-    odds_list = api_raw['competitions'][0].get('odds', [])
-    details = odds_list[0].get('details', '-') if odds_list else '-'
-    pick, odd, icon, _ = parse_odds_string(details, game['home'], game['away'])
-    
-    tv_str = f"📺 {game['tv']}" if game['tv'] else ""
-    clock_str = f"⏰ {game['clock']}" if game['status'] == 'in' else f"⏰ {game['time']}"
-    odd_display = f"@{odd:.2f}" if odd > 0 else "(S/ Odd)"
+def format_card(game):
+    tv_str = f"📺 {game.tv}" if game.tv else ""
+    clock_str = f"⏰ {game.clock}" if game.status == 'in' else f"⏰ {game.time}"
+    odd_display = f"@{game.odd:.2f}" if game.odd > 0 else "(S/ Odd)"
     
     return (
-        f"{safe_html(game['league'])} | {clock_str}\n"
-        f"🏟️ <i>{safe_html(game['venue'])}</i>\n"
-        f"⚽ <b>{safe_html(game['match'])}</b>\n"
+        f"{safe_html(game.league)} | {clock_str}\n"
+        f"🏟️ <i>{safe_html(game.venue)}</i>\n"
+        f"⚽ <b>{safe_html(game.match)}</b>\n"
         f"{tv_str}\n"
-        f"{icon} <b>{pick}</b>\n"
+        f"{game.icon} <b>{game.pick}</b>\n"
         f"💰 Odd: <b>{odd_display}</b>\n"
         f"━━━━━━━━━━━━━━━━━━━━\n"
     )
 
 def format_ufc_card(fight):
-    red_odd = american_to_decimal(fight['red_odds'])
-    blue_odd = american_to_decimal(fight['blue_odds'])
-    odds_str = f"💰 {fight['red']}: @{red_odd}\n💰 {fight['blue']}: @{blue_odd}" if red_odd > 0 else "⚠️ Aguardando Odds"
-    title_str = "🏆 <b>VALENDO CINTURÃO</b>\n" if fight['title'] else ""
-    return f"🥊 <b>UFC | {fight['time']}</b>\n📍 {safe_html(fight['venue'])}\nℹ️ {fight['card']}\n{title_str}🔴 {safe_html(fight['red'])}\n          Vs\n🔵 {safe_html(fight['blue'])}\n{odds_str}\n━━━━━━━━━━━━━━━━━━━━\n"
+    odds_str = f"💰 {fight.red}: @{fight.red_odd}\n💰 {fight.blue}: @{fight.blue_odd}" if fight.red_odd > 0 else "⚠️ Aguardando Odds"
+    title_str = "🏆 <b>VALENDO CINTURÃO</b>\n" if fight.title else ""
+    return f"🥊 <b>UFC | {fight.time}</b>\n📍 {safe_html(fight.venue)}\nℹ️ {fight.card}\n{title_str}🔴 {safe_html(fight.red)}\n          Vs\n🔵 {safe_html(fight.blue)}\n{odds_str}\n━━━━━━━━━━━━━━━━━━━━\n"
 
 def format_nba_card(game):
-    return f"🏀 <b>NBA | {game['clock']}</b>\n⚔️ <b>{safe_html(game['match'])}</b>\n{game['tv']}\n✅ {safe_html(game['pick'])}\n📊 Spread: {safe_html(game['odds'])}\n━━━━━━━━━━━━━━━━━━━━\n"
+    return f"🏀 <b>NBA | {game.clock}</b>\n⚔️ <b>{safe_html(game.match)}</b>\n{game.tv}\n✅ {safe_html(game.pick)}\n📊 Spread: {safe_html(game.odds)}\n━━━━━━━━━━━━━━━━━━━━\n"
 
-# --- 4. MOTORES DE BUSCA ---
+# --- 3.1 MODELOS E PARSER ESPN ---
+# Odds, palpite e favorito são calculados uma vez na ingestão; o JSON bruto do evento não é guardado.
 
-async def fetch_espn_soccer():
-    global TODAYS_GAMES
-    date_str = get_api_date_str()
-    leagues = {'bra.1': '🇧🇷 Brasileirão', 'uefa.champions': '🇪🇺 UCL', 'eng.1': '🇬🇧 Premier', 'esp.1': '🇪🇸 La Liga', 'ita.1': '🇮🇹 Serie A', 'ger.1': '🇩🇪 Bundesliga', 'bra.copa_do_brasil': '🏆 Copa BR'}
-    found_games = []
+@dataclass(slots=True)
+class SoccerGame:
+    id: str
+    code: str
+    league: str
+    home: str
+    away: str
+    kickoff: datetime
+    status: str          # 'agendado' | 'in' | 'post'
+    clock: str
+    score_home: int
+    score_away: int
+    venue: str
+    tv: str
+    pick: str
+    odd: float
+    icon: str
+    is_favorite: bool
+
+    @property
+    def match(self): return f"{self.home} x {self.away}"
+
+    @property
+    def time(self): return self.kickoff.strftime("%H:%M")
+
+@dataclass(slots=True)
+class NbaGame:
+    match: str
+    time: str
+    clock: str
+    tv: str
+    pick: str
+    odds: str
+
+@dataclass(slots=True)
+class UfcFight:
+    red: str
+    blue: str
+    time: str
+    venue: str
+    card: str
+    title: bool
+    red_odd: float
+    blue_odd: float
+
+def dig(obj, *path, default=None):
+    # Acesso tolerante a campo faltando: um campo ruim não derruba o evento (nem a liga)
+    for key in path:
+        try: obj = obj[key]
+        except (KeyError, IndexError, TypeError): return default
+    return default if obj is None else obj
+
+def parse_espn_date(value):
     br_tz = timezone(timedelta(hours=-3))
-    
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        for code, name in leagues.items():
-            try:
-                r = await client.get(f"https://site.api.espn.com/apis/site/v2/sports/soccer/{code}/scoreboard?dates={date_str}")
-                if r.status_code == 200:
-                    data = r.json()
-                    for event in data.get('events', []):
-                        status = event['status']['type']['state']
-                        clock = event['status']['type']['detail']
-                        status = 'in' if status == 'in' else ('post' if status == 'post' else 'agendado')
-                        
-                        comp = event['competitions'][0]['competitors']
-                        home = comp[0]['team']['name']; away = comp[1]['team']['name']
-                        sh = int(comp[0]['score']); sa = int(comp[1]['score'])
-                        venue = event['competitions'][0].get('venue', {}).get('fullName', '-')
-                        
-                        broadcasts = event['competitions'][0].get('broadcasts', [])
-                        tv = broadcasts[0]['names'][0] if broadcasts else ("Premiere/Globo" if 'bra' in code else "")
-                        dt = datetime.strptime(event['date'], "%Y-%m-%dT%H:%MZ").replace(tzinfo=timezone.utc).astimezone(br_tz)
-                        
-                        found_games.append({
-                            "id": event['id'], "raw": event,
-                            "match": f"{home} x {away}", "home": home, "away": away,
-                            "time": dt.strftime("%H:%M"), "league": name,
-                            "status": status, "clock": clock,
-                            "score_home": sh, "score_away": sa,
-                            "venue": venue, "tv": tv
-                        })
-            except: pass
-
-    found_games.sort(key=lambda x: x['time'])
+    for fmt in ("%Y-%m-%dT%H:%MZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try: return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc).astimezone(br_tz)
+        except (TypeError, ValueError): continue
+    return None
+
+def parse_score(value):
+    try: return int(value)
+    except (TypeError, ValueError): return 0
+
+def parse_soccer_event(event, code, name):
+    comp = dig(event, 'competitions', 0, default={})
+    home = dig(comp, 'competitors', 0, 'team', 'name'); away = dig(comp, 'competitors', 1, 'team', 'name')
+    kickoff = parse_espn_date(dig(event, 'date'))
+    if not (dig(event, 'id') and home and away and kickoff):
+        raise ValueError("evento sem id/times/data")
+
+    state = dig(event, 'status', 'type', 'state', default='pre')
+    status = 'in' if state == 'in' else ('post' if state == 'post' else 'agendado')
+    tv = dig(comp, 'broadcasts', 0, 'names', 0, default="Premiere/Globo" if 'bra' in code else "")
+    pick, odd, icon, is_fav = parse_odds_string(dig(comp, 'odds', 0, 'details', default='-'), home, away)
+    return SoccerGame(
+        id=str(event['id']), code=code, league=name, home=home, away=away, kickoff=kickoff,
+        status=status, clock=dig(event, 'status', 'type', 'detail', default=''),
+        score_home=parse_score(dig(comp, 'competitors', 0, 'score')), score_away=parse_score(dig(comp, 'competitors', 1, 'score')),
+        venue=dig(comp, 'venue', 'fullName', default='-'), tv=tv,
+        pick=pick, odd=odd, icon=icon, is_favorite=is_fav
+    )
+
+def parse_nba_event(event):
+    comp = dig(event, 'competitions', 0, default={})
+    t_home = dig(comp, 'competitors', 0, 'team'); t_away = dig(comp, 'competitors', 1, 'team')
+    kickoff = parse_espn_date(dig(event, 'date'))
+    if not (t_home and t_away and kickoff):
+        raise ValueError("evento sem times/data")
+
+    odds = dig(comp, 'odds', 0, 'details', default='-')
+    pick = f"Vitória do {t_home.get('name', '?')}"
+    if odds != '-' and len(odds.split(' ')) > 1:
+        if odds.split(' ')[0] in t_away.get('abbreviation', ''): pick = f"Vitória do {t_away.get('name', '?')}"
+    return NbaGame(
+        match=f"{t_away.get('name', '?')} @ {t_home.get('name', '?')}", time=kickoff.strftime("%H:%M"),
+        clock=dig(event, 'status', 'type', 'detail', default=''), tv="NBA League Pass", pick=pick, odds=odds
+    )
+
+def parse_ufc_event(event):
+    kickoff = parse_espn_date(dig(event, 'date'))
+    if not kickoff: raise ValueError("evento sem data")
+    fights = []
+    for comp in dig(event, 'competitions', default=[]):
+        red = dig(comp, 'competitors', 0, 'athlete', 'fullName'); blue = dig(comp, 'competitors', 1, 'athlete', 'fullName')
+        if not (red and blue): continue
+        fights.append(UfcFight(
+            red=red, blue=blue, time=kickoff.strftime("%d/%m %H:%M"),
+            venue=dig(comp, 'venue', 'fullName', default='-'), card=dig(comp, 'card', default='main'),
+            title=dig(comp, 'type', 'slug') == 'title-fight',
+            red_odd=american_to_decimal("-200"), blue_odd=american_to_decimal("+150")
+        ))
+    return fights
+
+def parse_events(data, parse_one, label):
+    # Evento com defeito é descartado sozinho (com log); o resto da liga segue
+    parsed = []
+    for event in dig(data, 'events', default=[]):
+        try: parsed.append(parse_one(event))
+        except Exception as e: logger.warning(f"ESPN {label}: evento {dig(event, 'id', default='?')} ignorado ({e!r:.120})")
+    return parsed
+
+def parse_soccer_scoreboard(data, code, name):
+    return parse_events(data, lambda event: parse_soccer_event(event, code, name), code)
+
+def parse_nba_scoreboard(data):
+    return parse_events(data, parse_nba_event, 'nba')
+
+def parse_ufc_scoreboard(data):
+    return [fight for fights in parse_events(data, parse_ufc_event, 'ufc') for fight in fights]
+
+# --- 4. MOTORES DE BUSCA ---
+
+LEAGUE_CATALOGUE = {
+    # Brasil e América do Sul
+    'bra.1': '🇧🇷 Brasileirão', 'bra.2': '🇧🇷 Série B', 'bra.copa_do_brasil': '🏆 Copa BR',
+    'bra.camp.paulista': '🇧🇷 Paulistão', 'bra.camp.carioca': '🇧🇷 Carioca',
+    'conmebol.libertadores': '🏆 Libertadores', 'conmebol.sudamericana': '🏆 Sul-Americana',
+    'arg.1': '🇦🇷 Argentino', 'uru.1': '🇺🇾 Uruguaio', 'chi.1': '🇨🇱 Chileno', 'col.1': '🇨🇴 Colombiano',
+    # Europa
+    'uefa.champions': '🇪🇺 UCL', 'uefa.europa': '🇪🇺 Europa League', 'uefa.europa.conf': '🇪🇺 Conference',
+    'eng.1': '🇬🇧 Premier', 'eng.2': '🇬🇧 Championship', 'eng.fa': '🇬🇧 FA Cup', 'eng.league_cup': '🇬🇧 Copa da Liga',
+    'esp.1': '🇪🇸 La Liga', 'esp.copa_del_rey': '🇪🇸 Copa do Rei', 'ita.1': '🇮🇹 Serie A', 'ita.coppa_italia': '🇮🇹 Coppa Italia',
+    'ger.1': '🇩🇪 Bundesliga', 'ger.dfb_pokal': '🇩🇪 Copa da Alemanha', 'fra.1': '🇫🇷 Ligue 1', 'por.1': '🇵🇹 Liga Portugal',
+    'ned.1': '🇳🇱 Eredivisie', 'bel.1': '🇧🇪 Belga', 'sco.1': '🏴 Escocês', 'tur.1': '🇹🇷 Turco',
+    # Resto do mundo e seleções
+    'usa.1': '🇺🇸 MLS', 'mex.1': '🇲🇽 Liga MX', 'ksa.1': '🇸🇦 Saudita',
+    'fifa.world': '🌍 Copa do Mundo', 'fifa.cwc': '🌍 Mundial de Clubes', 'fifa.worldq.conmebol': '🌎 Eliminatórias',
+    'conmebol.america': '🏆 Copa América', 'uefa.nations': '🇪🇺 Nations League', 'uefa.euro': '🇪🇺 Eurocopa',
+}
+
+def build_catalogue(spec):
+    if not spec: return dict(LEAGUE_CATALOGUE)
+    leagues = {}
+    for item in spec.split(","):
+        code, _, name = item.strip().partition("=")
+        if code: leagues[code] = name.strip() or LEAGUE_CATALOGUE.get(code, code)
+    return leagues
+
+SOCCER_LEAGUES = build_catalogue(LEAGUES)
+ESPN_BASE = "https://site.api.espn.com/apis/site/v2/sports"
+
+async def cached_get(client, url, parse, timeout, label=None, raw=False):
+    # GET condicional: 304 ou corpo idêntico devolvem o resultado já parseado, sem r.json()
+    # raw=True: o parser recebe os bytes e roda numa thread (ex: RSS com feedparser)
+    entry = RESPONSE_CACHE.get(url)
+    headers = {}
+    if entry:
+        if entry['etag']: headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']: headers['If-Modified-Since'] = entry['last_modified']
+
+    label = label or url
+    t0 = time.perf_counter()
+    try:
+        r = await asyncio.wait_for(client.get(url, headers=headers), timeout=timeout)
+    except Exception:
+        FETCH_ERRORS[label] = FETCH_ERRORS.get(label, 0) + 1
+        raise
+    FETCH_LATENCY.setdefault(label, LatencyRecorder()).record(time.perf_counter() - t0)
+    stats = CACHE_STATS.setdefault(url, {"hit": 0, "miss": 0})
+    if r.status_code == 304 and entry:
+        stats['hit'] += 1
+        return entry['parsed'], False
+    if r.status_code != 200: FETCH_ERRORS[label] = FETCH_ERRORS.get(label, 0) + 1
+    r.raise_for_status()
+
+    digest = hashlib.blake2b(r.content, digest_size=16).digest()
+    if entry and entry['hash'] == digest:
+        stats['hit'] += 1
+        entry['etag'] = r.headers.get('etag'); entry['last_modified'] = r.headers.get('last-modified')
+        return entry['parsed'], False
+
+    stats['miss'] += 1
+    t0 = time.perf_counter()
+    parsed = await asyncio.to_thread(parse, r.content) if raw else parse(r.json())
+    PARSE_LATENCY.setdefault(label, LatencyRecorder()).record(time.perf_counter() - t0)
+    RESPONSE_CACHE.pop(url, None)
+    RESPONSE_CACHE[url] = {
+        "etag": r.headers.get('etag'), "last_modified": r.headers.get('last-modified'),
+        "hash": digest, "parsed": parsed
+    }
+    # URLs levam a data: descarta as mais antigas para não crescer de um dia pro outro
+    while len(RESPONSE_CACHE) > RESPONSE_CACHE_MAX:
+        old_url = next(iter(RESPONSE_CACHE))
+        RESPONSE_CACHE.pop(old_url); CACHE_STATS.pop(old_url, None)
+    return parsed, True
+
+async def fetch_soccer_league(client, sem, code, name, date_str):
+    # Cada liga falha sozinha: timeout ou erro aqui não segura as outras (None = manter o que já temos)
+    global LAST_POLL_OK
+    url = f"{ESPN_BASE}/soccer/{code}/scoreboard?dates={date_str}"
+    try:
+        async with sem:
+            games, changed = await cached_get(client, url, lambda data: parse_soccer_scoreboard(data, code, name), league_timeout(code), code)
+        if changed: LEAGUE_VERSIONS[code] = LEAGUE_VERSIONS.get(code, 0) + 1
+        LAST_POLL_OK = time.time()
+        return games
+    except Exception as e:
+        logger.warning(f"ESPN {code}: falha na busca ({e!r:.160})")
+        return None
+
+async def fetch_leagues(codes, date_str):
+    client = get_http_client()
+    sem = asyncio.Semaphore(ESPN_CONCURRENCY)
+    results = await asyncio.gather(*(
+        fetch_soccer_league(client, sem, code, SOCCER_LEAGUES[code], date_str) for code in codes
+    ))
+    return dict(zip(codes, results))
+
+def merge_games(results, date_str):
+    # Liga que respondeu substitui seus jogos; liga que falhou mantém os anteriores
+    global TODAYS_GAMES, SOCCER_DATE
+    refreshed = {code for code, league_games in results.items() if league_games is not None}
+    keep = TODAYS_GAMES if date_str == SOCCER_DATE else []
+    found_games = [g for g in keep if g.code not in refreshed]
+    found_games += [g for league_games in results.values() if league_games for g in league_games]
+
+    found_games.sort(key=lambda x: x.kickoff)
     TODAYS_GAMES = found_games
+    SOCCER_DATE = date_str
     return found_games
 
+def discovery_stale(date_str):
+    return DISCOVERY["date"] != date_str or time.time() - DISCOVERY["at"] > DISCOVERY_TTL
+
+async def discover_leagues(date_str):
+    # Passa pelo catálogo inteiro uma vez: só ligas com jogo hoje seguem no polling.
+    # Liga que falhou conta como ativa (melhor uma busca a mais do que perder um jogo).
+    global ACTIVE_LEAGUES
+    results = await fetch_leagues(list(SOCCER_LEAGUES), date_str)
+    ACTIVE_LEAGUES = {code for code, league_games in results.items() if league_games is None or league_games}
+    DISCOVERY.update(date=date_str, at=time.time())
+    await STORE.save_discovery(date_str, ACTIVE_LEAGUES, DISCOVERY["at"])
+    print(f"🔎 [DESCOBERTA] {len(ACTIVE_LEAGUES)}/{len(SOCCER_LEAGUES)} ligas com jogo em {date_str}")
+    return results
+
+async def fetch_espn_soccer(codes=None):
+    # codes=None busca as ligas ativas; senão só as pedidas, mesclando com o resto de TODAYS_GAMES.
+    # Dia novo (ou descoberta vencida) roda a descoberta no lugar da busca normal.
+    if SUPERVISOR: return TODAYS_GAMES   # modo multiprocesso: os workers mantêm a grade atualizada
+    date_str = get_api_date_str()
+    if discovery_stale(date_str):
+        return merge_games(await discover_leagues(date_str), date_str)
+    codes = sorted(ACTIVE_LEAGUES) if codes is None else list(codes)
+    return merge_games(await fetch_leagues(codes, date_str), date_str)
+
+def plan_league_poll(code, games, now):
+    # Ao vivo: POLL_LIVE | kickoff dentro da janela (ou atrasado): POLL_SOON | resto: dorme até a janela do próximo kickoff
+    league_games = [g for g in games if g.code == code]
+    if any(g.status == 'in' for g in league_games):
+        state, interval = 'live', POLL_LIVE
+    else:
+        upcoming = [g.kickoff for g in league_games if g.status == 'agendado']
+        next_kickoff = min(upcoming) if upcoming else None
+        if next_kickoff and (next_kickoff - now).total_seconds() <= POLL_SOON_WINDOW:
+            state, interval = 'soon', POLL_SOON
+        elif next_kickoff:
+            wake = (next_kickoff - now).total_seconds() - POLL_SOON_WINDOW
+            state, interval = 'idle', int(max(POLL_SOON, min(wake, POLL_IDLE)))
+        else:
+            state, interval = 'idle', POLL_IDLE
+    POLL_SCHEDULE[code] = {"state": state, "interval": interval, "next": now + timedelta(seconds=interval)}
+
+def due_leagues(now):
+    return [code for code in ACTIVE_LEAGUES if code not in POLL_SCHEDULE or POLL_SCHEDULE[code]['next'] <= now]
+
+def seconds_until_next_poll(now):
+    # Agenda vazia: antes da descoberta busca já; depois dela (dia sem jogos) só confere a cada LOOP_TICK
+    if not POLL_SCHEDULE: return LOOP_TICK if DISCOVERY["date"] else 0
+    nxt = min(e['next'] for e in POLL_SCHEDULE.values())
+    return max(1.0, min((nxt - now).total_seconds(), LOOP_TICK))
+
 async def fetch_espn_ufc():
+    # Falha na busca mantém o card anterior (mesmo critério das ligas de futebol)
     global TODAYS_UFC
-    ufc_list = []
-    br_tz = timezone(timedelta(hours=-3))
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.get("https://site.api.espn.com/apis/site/v2/sports/mma/ufc/scoreboard")
-            if r.status_code == 200:
-                data = r.json()
-                for event in data.get('events', []):
-                    dt = datetime.strptime(event['date'], "%Y-%m-%dT%H:%MZ").replace(tzinfo=timezone.utc).astimezone(br_tz)
-                    for comp in event['competitions']:
-                        fighters = comp['competitors']
-                        red = fighters[0]['athlete']['fullName']; blue = fighters[1]['athlete']['fullName']
-                        ufc_list.append({
-                            "red": red, "blue": blue, "time": dt.strftime("%d/%m %H:%M"),
-                            "venue": comp.get('venue', {}).get('fullName', '-'),
-                            "card": comp.get('card', 'main'), "title": comp.get('type', {}).get('slug') == 'title-fight',
-                            "red_odds": "-200", "blue_odds": "+150"
-                        })
-    except: pass
-    TODAYS_UFC = ufc_list
-    return ufc_list
+        ufc_list, changed = await cached_get(get_http_client(), f"{ESPN_BASE}/mma/ufc/scoreboard", parse_ufc_scoreboard, league_timeout('ufc'), 'ufc')
+        if changed: LEAGUE_VERSIONS['ufc'] = LEAGUE_VERSIONS.get('ufc', 0) + 1
+        TODAYS_UFC = ufc_list
+    except Exception as e:
+        logger.warning(f"ESPN ufc: falha na busca ({e!r:.160})")
+    return TODAYS_UFC
 
 async def fetch_espn_nba():
     global TODAYS_NBA
     date_str = get_api_date_str()
-    nba_list = []
-    br_tz = timezone(timedelta(hours=-3))
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.get(f"https://site.api.espn.com/apis/site/v2/sports/basketball/nba/scoreboard?dates={date_str}")
-            if r.status_code == 200:
-                data = r.json()
-                for event in data.get('events', []):
-                    comp = event['competitions'][0]
-                    t_home = comp['competitors'][0]; t_away = comp['competitors'][1]
-                    odds = comp.get('odds', [{}])[0].get('details', '-')
-                    dt = datetime.strptime(event['date'], "%Y-%m-%dT%H:%MZ").replace(tzinfo=timezone.utc).astimezone(br_tz)
-                    pick = f"Vitória do {t_home['team']['name']}"
-                    if odds != '-' and len(odds.split(' ')) > 1:
-                        if odds.split(' ')[0] in t_away['team']['abbreviation']: pick = f"Vitória do {t_away['team']['name']}"
-
-                    nba_list.append({
-                        "match": f"{t_away['team']['name']} @ {t_home['team']['name']}",
-                        "time": dt.strftime("%H:%M"), "clock": event['status']['type']['detail'], 
-                        "tv": "NBA League Pass", "pick": pick, "odds": odds
-                    })
-    except: pass
-    TODAYS_NBA = nba_list
-    return nba_list
+        nba_list, changed = await cached_get(get_http_client(), f"{ESPN_BASE}/basketball/nba/scoreboard?dates={date_str}", parse_nba_scoreboard, league_timeout('nba'), 'nba')
+        if changed: LEAGUE_VERSIONS['nba'] = LEAGUE_VERSIONS.get('nba', 0) + 1
+        TODAYS_NBA = nba_list
+    except Exception as e:
+        logger.warning(f"ESPN nba: falha na busca ({e!r:.160})")
+    return TODAYS_NBA
+
+# --- 4.0 CACHE DE RENDERIZAÇÃO E SINGLE-FLIGHT ---
+
+class SingleFlight:
+    # Chamadas simultâneas com a mesma chave esperam a mesma execução em vez de disparar outra
+    def __init__(self):
+        self.inflight = {}
+
+    async def do(self, key, fn):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+FETCH_FLIGHT = SingleFlight()
+FETCHERS = {"fut": fetch_espn_soccer, "nba": fetch_espn_nba, "ufc": fetch_espn_ufc}
+FETCHED_AT = {}
+
+def is_fresh(kind):
+    return time.monotonic() - FETCHED_AT.get(kind, float("-inf")) < FETCH_FRESH_TTL
+
+async def fetch_shared(kind):
+    # Dado recente é servido direto; senão todos os chats esperam a mesma busca
+    if is_fresh(kind): return
+    async def run():
+        await FETCHERS[kind]()
+        FETCHED_AT[kind] = time.monotonic()
+    await FETCH_FLIGHT.do(kind, run)
+
+# Páginas HTML prontas por (tipo, cabeçalho), refeitas só quando a versão dos dados muda
+RENDER_CACHE = {}
+RENDER_CACHE_MAX = 32
+RENDER_STATS = {"hit": 0, "miss": 0}
+
+def data_version(kind):
+    if kind == "fut": return (SOCCER_DATE, tuple(LEAGUE_VERSIONS.get(code) for code in SOCCER_LEAGUES))
+    return LEAGUE_VERSIONS.get(kind)
+
+def render_items(kind, leagues=frozenset()):
+    if kind == "fut": return [format_card(g) for g in TODAYS_GAMES if not leagues or g.code in leagues]
+    if kind == "nba": return [format_nba_card(g) for g in TODAYS_NBA]
+    return [format_ufc_card(f) for f in TODAYS_UFC]
+
+def paginate(header, cards, limit=4000):
+    pages = []; txt = header
+    for card in cards:
+        if len(txt)+len(card) > limit:
+            pages.append(txt); txt = ""
+        txt += card
+    if txt: pages.append(txt)
+    return pages
+
+def rendered_pages(kind, header, leagues=frozenset()):
+    # Lista vazia = sem dados (o cabeçalho sozinho não vira página); leagues filtra a grade de futebol
+    key = (kind, header, leagues)
+    version = data_version(kind)
+    hit = RENDER_CACHE.get(key)
+    if hit and hit[0] == version:
+        RENDER_STATS["hit"] += 1
+        return hit[1]
+    RENDER_STATS["miss"] += 1
+    cards = render_items(kind, leagues)
+    pages = paginate(header, cards) if cards else []
+    if len(RENDER_CACHE) >= RENDER_CACHE_MAX: RENDER_CACHE.clear()
+    RENDER_CACHE[key] = (version, pages)
+    return pages
+
+# --- 4.1 FILA DE ENVIO (TELEGRAM) ---
+
+# Prioridade menor sai primeiro: gol/resultado passam na frente de grade e notícia
+PRIO_ALERT, PRIO_RESULT, PRIO_REPORT, PRIO_GRID, PRIO_NEWS = 0, 1, 2, 3, 4
+TG_MAX_LEN = 4096
+COALESCE_SEP = "\n━━━━━━━━━━━━━━━━━━━━\n"
+COALESCE_MAX = 3500   # folga abaixo do TG_MAX_LEN (medido em unidades UTF-16, como o Telegram conta)
+
+def tg_len(text):
+    # Emoji fora do BMP vale 2 unidades para o Telegram
+    return len(text.encode("utf-16-le")) // 2
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate; self.capacity = burst
+        self.tokens = float(burst); self.stamp = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def take(self):
+        # Não bloqueia: 0 = ficha consumida; senão quantos segundos faltam para a próxima
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class Outgoing:
+    __slots__ = ("chat_id", "texts", "prio", "coalesce", "created", "open", "size", "attempts")
+    def __init__(self, chat_id, text, prio, coalesce):
+        self.chat_id = chat_id; self.texts = [text]; self.prio = prio
+        self.coalesce = coalesce; self.created = time.monotonic(); self.open = True; self.attempts = 0
+        self.size = tg_len(text)   # tamanho de COALESCE_SEP.join(texts) em unidades UTF-16
+
+    def try_append(self, text):
+        size = self.size + tg_len(COALESCE_SEP) + tg_len(text)
+        if not self.open or size > COALESCE_MAX: return False
+        self.texts.append(text); self.size = size
+        return True
+
+class OutboundQueue:
+    # Fila limitada com prioridade; mensagens "coalesce" do mesmo chat/prioridade ainda na fila viram uma só.
+    # Cada chat tem sua própria fila; a fila "ready" só recebe chats que podem enviar agora (tem ficha no bucket
+    # e não está em RetryAfter). Chat bloqueado espera num timer, sem segurar worker: um canal em flood-wait
+    # não atrasa o gol de outro chat.
+    def __init__(self, maxsize, workers):
+        self.maxsize = maxsize
+        self.size = 0
+        self.workers = workers
+        self.seq = itertools.count()
+        self.global_bucket = TokenBucket(TG_GLOBAL_RATE, max(1, int(TG_GLOBAL_RATE)))
+        self.chat_buckets = {}
+        self.chats = {}      # chat_id -> heap (prio, seq, Outgoing)
+        self.ready = asyncio.PriorityQueue()   # (prio da cabeça, seq, chat_id)
+        self.queued = {}     # chat_id -> (prio, seq) da entrada válida em ready (as outras são velhas)
+        self.busy = set()    # chats em ready, enviando ou esperando timer
+        self.not_before = {} # chat_id -> monotonic até quando o chat está em backoff
+        self.pending = {}    # (chat_id, prio) -> Outgoing ainda aberto para agrupar
+        self.drained = asyncio.Event(); self.drained.set()
+        self.tasks = []
+        self.bot = None
+        self.stats = {"enqueued": 0, "sent": 0, "coalesced": 0, "dropped": 0, "retries": 0, "errors": 0}
+        self.latency = LatencyRecorder()
+
+    def submit(self, chat_id, text, prio, coalesce=False):
+        if coalesce:
+            item = self.pending.get((chat_id, prio))
+            if item and item.try_append(text):
+                self.stats["coalesced"] += 1
+                return True
+        if self.size >= self.maxsize:
+            self.stats["dropped"] += 1
+            logger.warning(f"Fila de envio cheia: descartando mensagem para {chat_id} (prio {prio})")
+            return False
+        item = Outgoing(chat_id, text, prio, coalesce)
+        self._push(item)
+        self.size += 1; self.drained.clear()
+        if coalesce: self.pending[(chat_id, prio)] = item
+        self.stats["enqueued"] += 1
+        if chat_id not in self.busy:
+            self.busy.add(chat_id); self._schedule(chat_id)
+        elif chat_id in self.queued and prio < self.queued[chat_id][0]:
+            self._enqueue_ready(chat_id, prio)   # sobe o chat na fila ready (a entrada antiga vira velha)
+        return True
+
+    def free(self): return self.maxsize - self.size
+
+    def _push(self, item):
+        heapq.heappush(self.chats.setdefault(item.chat_id, []), (item.prio, next(self.seq), item))
+
+    def _enqueue_ready(self, chat_id, prio):
+        entry = (prio, next(self.seq))
+        self.queued[chat_id] = entry
+        self.ready.put_nowait((*entry, chat_id))
+
+    def _schedule(self, chat_id):
+        # Chat com mensagem na fila: vai para ready se puder enviar já, senão acorda quando puder
+        delay = self.not_before.get(chat_id, 0) - time.monotonic()
+        if delay <= 0:
+            self.not_before.pop(chat_id, None)
+            delay = self.chat_buckets.setdefault(chat_id, TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)).take()
+            if delay <= 0:
+                self._enqueue_ready(chat_id, self.chats[chat_id][0][0])
+                return
+        asyncio.get_running_loop().call_later(delay, self._schedule, chat_id)
+
+    def start(self, bot):
+        self.bot = bot
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def join(self):
+        await self.drained.wait()
+
+    async def stop(self, timeout=5.0):
+        try: await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError: logger.warning(f"Fila de envio encerrada com {self.size} mensagens pendentes")
+        for t in self.tasks: t.cancel()
+        self.tasks = []
+
+    def depth(self): return self.size
+
+    def _done(self, item):
+        self.size -= 1
+        if self.size == 0: self.drained.set()
+
+    async def _worker(self):
+        while True:
+            prio, seq, chat_id = await self.ready.get()
+            if self.queued.get(chat_id) != (prio, seq): continue   # entrada velha (chat subiu de prioridade)
+            del self.queued[chat_id]
+            _, _, item = heapq.heappop(self.chats[chat_id])
+            requeue = False
+            try:
+                await self.global_bucket.acquire()
+                # A partir daqui o lote fecha: o que chegar depois vai para uma nova mensagem
+                item.open = False
+                if self.pending.get((chat_id, item.prio)) is item: del self.pending[(chat_id, item.prio)]
+                requeue = await self._send(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"Envio para {chat_id} falhou ({e!r:.160})")
+            finally:
+                if requeue: self._push(item)
+                else: self._done(item)
+                if self.chats[chat_id]: self._schedule(chat_id)
+                else: self.busy.discard(chat_id); del self.chats[chat_id]
+
+    async def _send(self, item):
+        # Uma tentativa só; erro temporário devolve True e o chat entra em backoff (sem dormir aqui)
+        text = COALESCE_SEP.join(item.texts)
+        try:
+            await self.bot.send_message(item.chat_id, text, parse_mode=ParseMode.HTML)
+            self.stats["sent"] += 1
+            self.latency.record(time.monotonic() - item.created)
+            return False
+        except RetryAfter as e:
+            wait = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+        except (BadRequest, Forbidden):
+            raise
+        except NetworkError:
+            wait = min(2 ** item.attempts, 30)
+        if item.attempts >= SEND_MAX_RETRIES:
+            self.stats["dropped"] += 1
+            logger.warning(f"Envio para {item.chat_id} desistido após {SEND_MAX_RETRIES} tentativas")
+            return False
+        item.attempts += 1
+        self.stats["retries"] += 1
+        self.not_before[item.chat_id] = time.monotonic() + wait
+        return True
+
+OUTBOX = OutboundQueue(SEND_QUEUE_MAX, SEND_WORKERS)
+
+def broadcast(chat_id, text, prio):
+    # Falha alto se a fila recusar: quem chama (ex: job agendado) decide se tenta de novo
+    if not OUTBOX.submit(chat_id, text, prio):
+        raise RuntimeError("fila de envio cheia")
+
+def broadcast_pages(chat_id, pages, prio):
+    # Tudo ou nada: se a fila não comporta a grade inteira, nada entra e o retry reenvia do zero sem duplicar página
+    if OUTBOX.free() < len(pages):
+        raise RuntimeError(f"fila de envio sem espaço para {len(pages)} páginas")
+    for page in pages: broadcast(chat_id, page, prio)
+
+# --- 4.2 ASSINATURAS (VÁRIOS CANAIS/GRUPOS) ---
+# Cada chat assina um subconjunto de ligas (códigos ESPN + 'nba'/'ufc'; vazio = todas) e pode ter horários próprios.
+# A ESPN é buscada uma vez só; o que muda com mais assinantes é apenas a entrega.
+
+@dataclass(slots=True)
+class Subscriber:
+    chat_id: str
+    leagues: frozenset
+    times: dict          # nome do broadcast -> "HH:MM" (sobrescreve o padrão)
+
+    def follows(self, league):
+        return not self.leagues or league in self.leagues
+
+    def follows_soccer(self):
+        return not self.leagues or not self.leagues.isdisjoint(SOCCER_LEAGUES)
+
+class SubscriptionRegistry:
+    def __init__(self):
+        self.subs = {}
+        self.by_league = {}     # liga -> chats que assinam explicitamente
+        self.wildcard = set()   # chats que assinam tudo
+
+    def _unindex(self, chat_id):
+        self.wildcard.discard(chat_id)
+        for chats in self.by_league.values(): chats.discard(chat_id)
+
+    def set(self, sub):
+        self._unindex(sub.chat_id)
+        self.subs[sub.chat_id] = sub
+        if not sub.leagues: self.wildcard.add(sub.chat_id)
+        for league in sub.leagues: self.by_league.setdefault(league, set()).add(sub.chat_id)
+
+    def remove(self, chat_id):
+        self._unindex(chat_id)
+        return self.subs.pop(chat_id, None)
+
+    def get(self, chat_id): return self.subs.get(chat_id)
+    def all(self): return list(self.subs.values())
+
+    def chats_for(self, league):
+        return self.wildcard | self.by_league.get(league, set())
+
+REGISTRY = SubscriptionRegistry()
+
+def league_codes():
+    return set(SOCCER_LEAGUES) | {"nba", "ufc"}
+
+def deliver(league, text, prio, coalesce=False):
+    # Fan-out: uma mensagem por chat interessado, todas pela mesma fila limitada
+    for chat_id in REGISTRY.chats_for(league):
+        OUTBOX.submit(chat_id, text, prio, coalesce=coalesce)
+
+def clean_times(chat_id, times):
+    # Horário inválido (ex: "25:00" no SUBSCRIPTIONS) cai no padrão com um aviso, em vez de derrubar o startup
+    clean = {}
+    for name, value in dict(times).items():
+        if name in BROADCAST_JOBS and parse_hhmm(value): clean[name] = str(value)
+        else: logger.warning(f"Horário inválido para {name} em {chat_id}: {value!r}; usando o padrão")
+    return clean
+
+def load_subscriptions():
+    # Banco primeiro; CHANNEL_ID (tudo) e SUBSCRIPTIONS (env) por cima
+    for chat_id, leagues, times in STORE.load_subscriptions():
+        REGISTRY.set(Subscriber(chat_id, frozenset(leagues), clean_times(chat_id, times)))
+    if CHANNEL_ID and not REGISTRY.get(CHANNEL_ID):
+        REGISTRY.set(Subscriber(CHANNEL_ID, frozenset(), {}))
+    if SUBSCRIPTIONS:
+        try:
+            for item in json.loads(SUBSCRIPTIONS):
+                chat_id = str(item["chat_id"])
+                REGISTRY.set(Subscriber(chat_id, frozenset(item.get("leagues", [])), clean_times(chat_id, item.get("times", {}))))
+        except Exception as e:
+            logger.warning(f"SUBSCRIPTIONS inválido ({e!r:.160})")
+    print(f"📬 {len(REGISTRY.subs)} assinante(s) carregado(s)")
 
 # --- 5. O CÉREBRO: ALERTAS, GREEN/RED E FECHAMENTO ---
 
+# Motor de eventos: cada snapshot novo de um jogo é comparado com o anterior (ALERT_MEMORY)
+# e as diferenças viram eventos tipados entregues aos assinantes.
+EV_GOAL, EV_GOAL_DISALLOWED, EV_STATUS, EV_MINUTE = "goal", "goal_disallowed", "status", "minute"
+MINUTE_BUCKET = 10
+MINUTE_RE = re.compile(r"^(\d+)'")
+
+@dataclass(slots=True)
+class GameEvent:
+    kind: str
+    game: SoccerGame
+    side: str = ""        # 'home' | 'away' (gol / gol anulado)
+    old: str = ""         # status anterior (mudança de status)
+    bucket: int = 0       # faixa de minuto (minuto // MINUTE_BUCKET)
+    score: tuple = (0, 0) # placar logo após o evento
+
+SUBSCRIBERS = {}
+
+def subscribe(kind):
+    def register(fn):
+        SUBSCRIBERS.setdefault(kind, []).append(fn)
+        return fn
+    return register
+
+def emit(event):
+    EVENTS_EMITTED[event.kind] = EVENTS_EMITTED.get(event.kind, 0) + 1
+    for fn in SUBSCRIBERS.get(event.kind, ()):
+        try: fn(event)
+        except Exception as e: logger.warning(f"Assinante {fn.__name__} falhou em {event.kind} ({e!r:.160})")
+
+def game_minute(clock):
+    # "78'" -> 78 | "90'+3'" -> 90 | "HT", "FT", horário... -> None
+    m = MINUTE_RE.match(clock or "")
+    return int(m.group(1)) if m else None
+
+def minute_bucket(game):
+    minute = game_minute(game.clock) if game.status == 'in' else None
+    return None if minute is None else minute // MINUTE_BUCKET
+
+def diff_game(old, game, bucket):
+    events = []
+    # Um evento por gol (os dois lados podem ter marcado entre dois polls); placar que desce = gol anulado (VAR)
+    for side, prev, new in (('home', old['h'], game.score_home), ('away', old['a'], game.score_away)):
+        if new == prev: continue
+        step = 1 if new > prev else -1
+        kind = EV_GOAL if step > 0 else EV_GOAL_DISALLOWED
+        for value in range(prev + step, new + step, step):
+            score = (value, old['a']) if side == 'home' else (game.score_home, value)
+            events.append(GameEvent(kind, game, side=side, score=score))
+    if game.status != old['status']:
+        events.append(GameEvent(EV_STATUS, game, old=old['status']))
+    if bucket is not None and bucket != old.get('bucket'):
+        events.append(GameEvent(EV_MINUTE, game, bucket=bucket))
+    return events
+
+def process_game(game):
+    # Caminho rápido: snapshot igual ao anterior não gera trabalho nenhum
+    bucket = minute_bucket(game)
+    old = ALERT_MEMORY.get(game.id)
+    if old is None:
+        ALERT_MEMORY[game.id] = {'h': game.score_home, 'a': game.score_away, 'status': game.status, 'bucket': bucket, 'ts': time.time()}
+        STORE.mark_game(game.id)
+        return
+    if (old['h'], old['a'], old['status'], old.get('bucket')) == (game.score_home, game.score_away, game.status, bucket):
+        return
+
+    events = diff_game(old, game, bucket)
+    # bucket guardado como veio (None no intervalo/fim), senão jogo encerrado nunca cai no caminho rápido
+    old['h'] = game.score_home; old['a'] = game.score_away; old['status'] = game.status; old['bucket'] = bucket
+    old['ts'] = time.time()
+    STORE.mark_game(game.id)
+    for event in events: emit(event)
+
+@subscribe(EV_GOAL)
+def alert_goal(ev):
+    game = ev.game
+    if game.status not in ('in', 'post'): return
+    scorer = game.home if ev.side == 'home' else game.away
+    msg = f"⚽ <b>GOOOOOOL DO {scorer.upper()}!</b>\n\n🏟️ {game.match}\n⏱️ {game.clock}\n🔢 {ev.score[0]} - {ev.score[1]}"
+    deliver(game.code, msg, PRIO_ALERT, coalesce=True)
+
+@subscribe(EV_GOAL_DISALLOWED)
+def alert_goal_disallowed(ev):
+    game = ev.game
+    team = game.home if ev.side == 'home' else game.away
+    msg = f"🚫 <b>GOL ANULADO ({team.upper()})</b>\n\n🏟️ {game.match}\n⏱️ {game.clock}\n🔢 {ev.score[0]} - {ev.score[1]}"
+    deliver(game.code, msg, PRIO_ALERT, coalesce=True)
+
+@subscribe(EV_MINUTE)
+@subscribe(EV_GOAL)
+@subscribe(EV_GOAL_DISALLOWED)
+def alert_pressure(ev):
+    # GATILHO: ALERTA DE PRESSÃO (empate entre os 70' e os 89')
+    # Reavaliado na virada de minuto e a cada gol/gol anulado (empate aos 83' já passou do evento dos 80')
+    game = ev.game
+    memory = ALERT_MEMORY[game.id]
+    bucket = minute_bucket(game)
+    if bucket is None or bucket * MINUTE_BUCKET not in range(70, 90) or memory.get('alerted'): return
+    if game.score_home != game.score_away: return
+    msg = f"🔥 <b>ALERTA DE PRESSÃO!</b>\n\n🏟️ {game.match}\n⏱️ {game.clock} | Empate!\n💡 <i>Fique atento para gol no final!</i>"
+    deliver(game.code, msg, PRIO_ALERT, coalesce=True)
+    memory['alerted'] = True
+    STORE.mark_game(game.id)
+
+@subscribe(EV_STATUS)
+def settle_pick(ev):
+    # GATILHO: CÁLCULO DE GREEN E RED (O JOGO ACABOU)
+    game = ev.game
+    if not (game.status == 'post' and ev.old == 'in' and game.is_favorite): return
+    sh = game.score_home; sa = game.score_away
+    pick = game.pick
+
+    # Validação matemática da aposta
+    is_green = False
+    is_red = False
+    if "Vitória" in pick:
+        if game.home in pick:
+            if sh > sa: is_green = True
+            else: is_red = True
+        elif game.away in pick:
+            if sa > sh: is_green = True
+            else: is_red = True
+
+    if is_green:
+        DAILY_STATS["green"] += 1; STORE.mark_stats()
+        res_icon = "✅✅ GREEN ABSOLUTO"
+    elif is_red:
+        DAILY_STATS["red"] += 1; STORE.mark_stats()
+        res_icon = "❌ RED"
+    else:
+        res_icon = "🏁 FINALIZADO" # Fallback
+    if is_green or is_red:
+        STORE.record_pick((game.id, get_api_date_str(), game.code, game.match, pick, game.odd, "G" if is_green else "R", time.time()))
+
+    print(f"💰 [RESULTADO] {game.match} -> {res_icon}")
+    msg = f"{res_icon}\n\n⚽ {game.match}\n🔢 Placar Final: {sh} - {sa}\n🎯 Aposta: {pick}"
+    deliver(game.code, msg, PRIO_RESULT, coalesce=True)
+
+async def poll_due(due=None):
+    # Busca as ligas devidas e replaneja a agenda (roda no bot ou dentro de um worker)
+    if due is None: due = due_leagues(get_real_server_date())
+    if due or discovery_stale(get_api_date_str()): await fetch_espn_soccer(due)
+    now = get_real_server_date()
+    # Liga que acabou de ser descoberta entra na agenda já; liga sem jogo hoje sai dela
+    for code in set(due) | (ACTIVE_LEAGUES - POLL_SCHEDULE.keys()): plan_league_poll(code, TODAYS_GAMES, now)
+    for code in POLL_SCHEDULE.keys() - ACTIVE_LEAGUES: del POLL_SCHEDULE[code]
+
+async def poll_cycle(processed, due=None):
+    # Uma passada do master loop: busca as ligas devidas, replaneja, roda o motor de eventos e grava o estado.
+    # processed: liga -> versão do placar já passada pelo motor de eventos (mantido por quem chama)
+    await poll_due(due)
+    await run_engine(processed)
+
+async def run_engine(processed):
+    global DAILY_STATS, LAST_PRUNE
+    current_date_str = get_api_date_str()
+    
+    # Zera o Cofre se virou o dia
+    if DAILY_STATS["date"] != current_date_str:
+        DAILY_STATS = {"date": current_date_str, "green": 0, "red": 0}
+        STORE.mark_stats()
+    
+    # --- MOTOR DE EVENTOS: só ligas cujo placar mudou desde a última passada ---
+    changed = {code for code in SOCCER_LEAGUES if LEAGUE_VERSIONS.get(code) != processed.get(code)}
+    for game in TODAYS_GAMES:
+        if game.code in changed: process_game(game)
+    for code in changed: processed[code] = LEAGUE_VERSIONS.get(code)
+
+    if time.time() - LAST_PRUNE > 3600:
+        prune_alert_memory({g.id for g in TODAYS_GAMES})
+        LAST_PRUNE = time.time()
+    await STORE.flush(ALERT_MEMORY, DAILY_STATS)
+
 async def master_automation_loop(app):
     print("🤖 MASTER LOOP: Vigiando Placar, Green/Red e Horários...")
-    global ALERT_MEMORY, DAILY_STATS
+    processed = {}
     
     while True:
-        await asyncio.sleep(60)
+        await asyncio.sleep(seconds_until_next_poll(get_real_server_date()))
         try:
-            games = await fetch_espn_soccer()
-            now = datetime.now(timezone(timedelta(hours=-3)))
-            current_date_str = get_api_date_str()
-            
-            # Zera o Cofre se virou o dia
-            if DAILY_STATS["date"] != current_date_str:
-                DAILY_STATS = {"date": current_date_str, "green": 0, "red": 0, "closed": False}
-            
-            # --- LOOP DE JOGOS (ALERTAS) ---
-            for game in games:
-                gid = game['id']; status = game['status']
-                sh = game['score_home']; sa = game['score_away']
-                clock = game['clock']
-                
-                if gid not in ALERT_MEMORY:
-                    ALERT_MEMORY[gid] = {'h': sh, 'a': sa, 'status': status}
-                    continue
-                old = ALERT_MEMORY[gid]
-                
-                # GATILHO: GOL
-                if status == 'in' and (sh > old['h'] or sa > old['a']):
-                    scorer = game['home'] if sh > old['h'] else game['away']
-                    msg = f"⚽ <b>GOOOOOOL DO {scorer.upper()}!</b>\n\n🏟️ {game['match']}\n⏱️ {clock}\n🔢 {sh} - {sa}"
-                    try: await app.bot.send_message(CHANNEL_ID, msg, parse_mode=ParseMode.HTML)
-                    except: pass
-                
-                # GATILHO: ALERTA DE PRESSÃO
-                if status == 'in' and ("7" in clock or "8" in clock) and 'alerted' not in old:
-                    if sh == sa:
-                        msg = f"🔥 <b>ALERTA DE PRESSÃO!</b>\n\n🏟️ {game['match']}\n⏱️ {clock} | Empate!\n💡 <i>Fique atento para gol no final!</i>"
-                        try: await app.bot.send_message(CHANNEL_ID, msg, parse_mode=ParseMode.HTML)
-                        except: pass
-                        old['alerted'] = True
-                
-                # GATILHO: CÁLCULO DE GREEN E RED (O JOGO ACABOU)
-                if status == 'post' and old['status'] == 'in':
-                    odds_list = game['raw']['competitions'][0].get('odds', [])
-                    details = odds_list[0].get('details', '-') if odds_list else '-'
-                    pick, _, _, is_fav = parse_odds_string(details, game['home'], game['away'])
-                    
-                    if is_fav:
-                        # Validação matemática da aposta
-                        is_green = False
-                        is_red = False
-                        
-                        if "Vitória" in pick:
-                            if game['home'] in pick:
-                                if sh > sa: is_green = True
-                                else: is_red = True
-                            elif game['away'] in pick:
-                                if sa > sh: is_green = True
-                                else: is_red = True
-                                
-                        if is_green:
-                            DAILY_STATS["green"] += 1
-                            res_icon = "✅✅ GREEN ABSOLUTO"
-                        elif is_red:
-                            DAILY_STATS["red"] += 1
-                            res_icon = "❌ RED"
-                        else:
-                            res_icon = "🏁 FINALIZADO" # Fallback
-                            
-                        print(f"💰 [RESULTADO] {game['match']} -> {res_icon}")
-                        
-                        msg = f"{res_icon}\n\n⚽ {game['match']}\n🔢 Placar Final: {sh} - {sa}\n🎯 Aposta: {pick}"
-                        try: await app.bot.send_message(CHANNEL_ID, msg, parse_mode=ParseMode.HTML)
-                        except: pass
-                
-                old['h'] = sh; old['a'] = sa; old['status'] = status
-                ALERT_MEMORY[gid] = old
-
-            # --- AUTOMAÇÕES DE HORÁRIO FIXO ---
-            
-            # GRADE DA MANHÃ
-            if now.hour == 8 and now.minute == 0:
-                if TODAYS_GAMES:
-                    txt = f"🦁 <b>BOM DIA! GRADE VIP | {get_display_date()}</b> 🦁\n\n"
-                    for g in TODAYS_GAMES:
-                        card = format_card(g, g['raw'])
-                        if len(txt)+len(card) > 4000:
-                            await app.bot.send_message(CHANNEL_ID, txt, parse_mode=ParseMode.HTML); txt = ""
-                        txt += card
-                    if txt: await app.bot.send_message(CHANNEL_ID, txt, parse_mode=ParseMode.HTML)
-
-            # NBA A TARDE
-            if now.hour == 16 and now.minute == 0:
-                await fetch_espn_nba()
-                if TODAYS_NBA:
-                    txt = f"🏀 <b>NBA | {get_display_date()}</b>\n\n"
-                    for g in TODAYS_NBA: txt += format_nba_card(g)
-                    await app.bot.send_message(CHANNEL_ID, txt, parse_mode=ParseMode.HTML)
-
-            # 📊 FECHAMENTO DO DIA (Balanço de Greens e Reds)
-            if now.hour == 23 and now.minute == 50 and not DAILY_STATS["closed"]:
-                g_count = DAILY_STATS["green"]
-                r_count = DAILY_STATS["red"]
-                total = g_count + r_count
-                
-                if total > 0:
-                    win_rate = round((g_count / total) * 100, 1)
-                    relatorio = (
-                        f"📊 <b>FECHAMENTO DO DIA | {get_display_date()}</b> 📊\n\n"
-                        f"✅ <b>GREENS:</b> {g_count}\n"
-                        f"❌ <b>REDS:</b> {r_count}\n"
-                        f"📈 <b>Taxa de Acerto:</b> {win_rate}%\n\n"
-                        f"🦁 <i>O mercado nunca dorme. Voltamos amanhã!</i>"
-                    )
-                    try: await app.bot.send_message(CHANNEL_ID, relatorio, parse_mode=ParseMode.HTML)
-                    except: pass
-                
-                DAILY_STATS["closed"] = True
-
+            await poll_cycle(processed)
         except Exception as e:
             print(f"⚠️ ERRO NO MASTER LOOP: {e}")
 
+# --- 5.1 AGENDA FIXA (JobQueue): GRADE 08:00, NBA 16:00, FECHAMENTO 23:50 ---
+
+async def send_morning_grid(sub):
+    await fetch_shared("fut")
+    broadcast_pages(sub.chat_id, rendered_pages("fut", f"🦁 <b>BOM DIA! GRADE VIP | {get_display_date()}</b> 🦁\n\n", sub.leagues), PRIO_GRID)
+
+async def send_nba_grid(sub):
+    if not sub.follows("nba"): return
+    await fetch_shared("nba")
+    broadcast_pages(sub.chat_id, rendered_pages("nba", f"🏀 <b>NBA | {get_display_date()}</b>\n\n"), PRIO_GRID)
+
+async def send_closing_report(sub):
+    # 📊 Balanço de Greens e Reds (só conta se o cofre é de hoje)
+    today = get_api_date_str()
+    if DAILY_STATS["date"] != today: return
+    if sub.leagues:
+        # Assinante filtrado só vê o placar das ligas que recebe (histórico já gravado no flush do poll)
+        g_count, r_count = await asyncio.to_thread(STORE.day_tally, today, sub.leagues)
+    else:
+        g_count = DAILY_STATS["green"]
+        r_count = DAILY_STATS["red"]
+    total = g_count + r_count
+    if total == 0: return
+    win_rate = round((g_count / total) * 100, 1)
+    relatorio = (
+        f"📊 <b>FECHAMENTO DO DIA | {get_display_date()}</b> 📊\n\n"
+        f"✅ <b>GREENS:</b> {g_count}\n"
+        f"❌ <b>REDS:</b> {r_count}\n"
+        f"📈 <b>Taxa de Acerto:</b> {win_rate}%\n\n"
+        f"🦁 <i>O mercado nunca dorme. Voltamos amanhã!</i>"
+    )
+    broadcast(sub.chat_id, relatorio, PRIO_REPORT)
+
+# nome -> (hora, minuto, função) padrão; cada assinante pode trocar o horário
+BROADCAST_JOBS = {
+    "grade_manha": (8, 0, send_morning_grid),
+    "nba_tarde": (16, 0, send_nba_grid),
+    "fechamento": (23, 50, send_closing_report),
+}
+BROADCAST_LOCK = asyncio.Lock()
+
+def parse_hhmm(value):
+    # "HH:MM" válido -> (hora, minuto); qualquer outra coisa (25:00, número solto, lixo) -> None
+    try:
+        hour, minute = (int(x) for x in str(value).split(":"))
+    except ValueError:
+        return None
+    return (hour, minute) if 0 <= hour < 24 and 0 <= minute < 60 else None
+
+def broadcast_time(sub, name):
+    hour, minute, _ = BROADCAST_JOBS[name]
+    custom = sub.times.get(name)
+    if custom:
+        parsed = parse_hhmm(custom)
+        if parsed: return parsed
+        logger.warning(f"Horário inválido para {name} em {sub.chat_id}: {custom!r}; usando {hour:02d}:{minute:02d}")
+    return hour, minute
+
+def broadcast_key(name, chat_id):
+    return f"{name}:{chat_id}"
+
+async def run_broadcast(context: ContextTypes.DEFAULT_TYPE):
+    name, chat_id = context.job.data
+    sub = REGISTRY.get(chat_id)
+    if sub is None: return
+    _, _, fn = BROADCAST_JOBS[name]
+    key = broadcast_key(name, chat_id)
+    async with BROADCAST_LOCK:
+        today = get_api_date_str()
+        if BROADCASTS_SENT.get(key) == today: return
+        try:
+            await fn(sub)
+        except Exception as e:
+            # Falhou: tenta de novo em 1 min enquanto ainda estiver dentro da janela de recuperação
+            logger.warning(f"Broadcast {key} falhou ({e!r:.160})")
+            if broadcast_overdue(sub, name, get_real_server_date()):
+                context.job_queue.run_once(run_broadcast, 60, data=(name, chat_id), name=f"{key}:retry")
+            return
+        BROADCASTS_SENT[key] = today
+        await STORE.save_broadcast(key, today)
+        print(f"📣 [AGENDA] {key} enviado ({today})")
+
+def broadcast_overdue(sub, name, now):
+    # Recuperação só no mesmo dia: grade/fechamento falam do dia corrente, então um horário de ontem
+    # perdido (ex: fechamento 23:50 e reinício 00:05) não é reenviado; missed_yesterday só avisa no log.
+    hour, minute = broadcast_time(sub, name)
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    late = (now - scheduled).total_seconds()
+    return 0 <= late <= BROADCAST_CATCHUP_GRACE and BROADCASTS_SENT.get(broadcast_key(name, sub.chat_id)) != now.strftime("%Y%m%d")
+
+def missed_yesterday(sub, name, now):
+    hour, minute = broadcast_time(sub, name)
+    scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0) - timedelta(days=1)
+    late = (now - scheduled).total_seconds()
+    yesterday = scheduled.strftime("%Y%m%d")
+    return late <= BROADCAST_CATCHUP_GRACE and BROADCASTS_SENT.get(broadcast_key(name, sub.chat_id)) != yesterday
+
+def schedule_subscriber(job_queue, sub, catch_up=True):
+    # (Re)agenda os broadcasts de um chat; chamado no startup e quando a assinatura muda
+    br_tz = timezone(timedelta(hours=-3))
+    now = get_real_server_date()
+    unschedule_subscriber(job_queue, sub.chat_id)
+    for name in BROADCAST_JOBS:
+        hour, minute = broadcast_time(sub, name)
+        key = broadcast_key(name, sub.chat_id)
+        job_queue.run_daily(run_broadcast, time=dtime(hour, minute, tzinfo=br_tz), data=(name, sub.chat_id), name=key)
+        # Recupera o que ficou para trás enquanto o bot estava fora do ar
+        if catch_up and broadcast_overdue(sub, name, now):
+            print(f"⏪ [AGENDA] Recuperando {key} atrasado")
+            job_queue.run_once(run_broadcast, 1, data=(name, sub.chat_id), name=f"{key}:catchup")
+        elif catch_up and missed_yesterday(sub, name, now):
+            logger.warning(f"Broadcast {key} de ontem não foi enviado (bot fora do ar na virada do dia); não é recuperado")
+
+def unschedule_subscriber(job_queue, chat_id):
+    for name in BROADCAST_JOBS:
+        for job in job_queue.get_jobs_by_name(broadcast_key(name, chat_id)): job.schedule_removal()
+
+def schedule_broadcasts(app: Application):
+    for sub in REGISTRY.all(): schedule_subscriber(app.job_queue, sub)
+
+# --- 5.2 GIRO DE NOTÍCIAS (VÁRIOS FEEDS) ---
+
+@dataclass(slots=True)
+class NewsItem:
+    guid: str
+    title: str
+    link: str
+    text: str        # título + resumo em minúsculas (para o ranking)
+    published: float
+
+def news_guid(entry):
+    # Mesmo link em feeds diferentes = mesma notícia (ignora query string e barra final)
+    link = (entry.get("link") or "").split("?")[0].rstrip("/")
+    return link or entry.get("id") or entry.get("title", "")
+
+def parse_feed(content):
+    feed = feedparser.parse(content)
+    items = []
+    for entry in feed.entries[:NEWS_ENTRIES_PER_FEED]:
+        title = entry.get("title")
+        if not title or not entry.get("link"): continue
+        stamp = entry.get("published_parsed") or entry.get("updated_parsed")
+        published = calendar.timegm(stamp) if stamp else 0.0
+        text = f"{title} {re.sub('<[^>]+>', ' ', entry.get('summary', ''))}".lower()
+        items.append(NewsItem(news_guid(entry), title, entry.link, text, published))
+    return items
+
+def news_keywords(games):
+    # Times do dia pesam 2, ligas do dia pesam 1 (nome sem emoji/bandeira)
+    weights = {}
+    for g in games:
+        for team in (g.home, g.away): weights[team.lower()] = 2
+        league = re.sub(r"[^\w\s.-]", "", g.league).strip().lower()
+        if len(league) > 3: weights.setdefault(league, 1)
+    if not weights: return None, weights
+    pattern = re.compile(r"\b(" + "|".join(re.escape(k) for k in sorted(weights, key=len, reverse=True)) + r")\b")
+    return pattern, weights
+
+def rank_news(items, games, now):
+    pattern, weights = news_keywords(games)
+    scored = []
+    for item in items:
+        if item.published and now - item.published > NEWS_MAX_AGE: continue
+        score = sum(weights[m] for m in set(pattern.findall(item.text))) if pattern else 0
+        scored.append((score, item.published, item))
+    scored.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    return [item for _, _, item in scored]
+
+async def fetch_news():
+    client = get_http_client()
+
+    async def one(url):
+        try:
+            items, _ = await cached_get(client, url, parse_feed, ESPN_TIMEOUT, f"news:{url.split('/')[2]}", raw=True)
+            return items
+        except Exception as e:
+            logger.warning(f"Feed {url}: falha na busca ({e!r:.160})")
+            return []
+
+    merged = {}
+    for items in await asyncio.gather(*(one(url) for url in NEWS_FEEDS)):
+        for item in items: merged.setdefault(item.guid, item)
+    return list(merged.values())
+
+async def news_cycle():
+    # Busca os feeds, descarta o que já foi postado, ranqueia pelos jogos de hoje e posta as melhores num giro só
+    items = await fetch_news()
+    if not items: return 0
+    unseen = set(await asyncio.to_thread(STORE.unseen_news, [i.guid for i in items]))
+    now = time.time()
+    top = rank_news([i for i in items if i.guid in unseen], TODAYS_GAMES, now)[:NEWS_PER_POST]
+    if not top: return 0
+    msg = "🌍 <b>GIRO DE NOTÍCIAS</b>\n\n" + "\n\n".join(f"📰 {safe_html(i.title)}\n🔗 {i.link}" for i in top)
+    # Os feeds são de futebol: chat que só assina NBA/UFC não recebe o giro
+    for sub in REGISTRY.all():
+        if sub.follows_soccer(): broadcast(sub.chat_id, msg, PRIO_NEWS)
+    await STORE.mark_news([i.guid for i in top], now)
+    return len(top)
+
 async def news_loop(app):
     while True:
-        await asyncio.sleep(14400)
+        await asyncio.sleep(NEWS_INTERVAL)
+        try:
+            await news_cycle()
+        except Exception as e:
+            logger.warning(f"Giro de notícias falhou ({e!r:.160})")
+
+# --- 5.3 BILHETE DE OURO (MÚLTIPLA POR ALVO) ---
+# Busca a combinação cujo produto das odds fica mais perto do alvo. Trabalha em log-odds (produto vira soma)
+# com branch-and-bound: candidatos ordenados por odd, somas prefixadas dão o menor/maior total alcançável
+# com as pernas que faltam, e ramos que não conseguem melhorar a melhor solução são cortados.
+
+def ticket_candidates(games, now):
+    return [g for g in games
+            if g.is_favorite and g.status == 'agendado' and g.kickoff > now
+            and TICKET_MIN_ODD <= g.odd <= TICKET_MAX_ODD]
+
+def build_accumulator(games, target, legs, now=None, window=TICKET_WINDOW, min_gap=TICKET_MIN_GAP, max_nodes=TICKET_MAX_NODES):
+    cands = sorted(ticket_candidates(games, now or get_real_server_date()), key=lambda g: g.odd)
+    n = len(cands)
+    # Menos ligas que pernas = impossível (e o branch-and-bound rodaria até estourar max_nodes)
+    if legs < 1 or n < legs or len({g.code for g in cands}) < legs: return None
+    logs = [math.log(g.odd) for g in cands]
+    prefix = [0.0]
+    for x in logs: prefix.append(prefix[-1] + x)
+    goal = math.log(target)
+    best = [float("inf"), None]   # erro |log(total) - log(alvo)|, combinação
+    nodes = 0
+
+    def fits(g, chosen):
+        for o in chosen:
+            if o.code == g.code: return False
+            gap = abs((g.kickoff - o.kickoff).total_seconds())
+            if gap < min_gap: return False
+        if chosen:
+            first = min(min(o.kickoff for o in chosen), g.kickoff)
+            last = max(max(o.kickoff for o in chosen), g.kickoff)
+            if (last - first).total_seconds() > window: return False
+        return True
+
+    def search(start, chosen, total):
+        nonlocal nodes
+        left = legs - len(chosen)
+        if left == 0:
+            err = abs(total - goal)
+            if err < best[0]: best[0], best[1] = err, list(chosen)
+            return
+        for i in range(start, n - left + 1):
+            nodes += 1
+            if nodes > max_nodes or best[0] < 1e-3: return
+            # Menor total possível a partir de i: as próximas (left) odds; maior: as (left-1) maiores do fim
+            low = total + prefix[i + left] - prefix[i]
+            if low - goal >= best[0]: return   # ordenado: daqui pra frente só piora
+            high = total + logs[i] + prefix[n] - prefix[n - left + 1]
+            if goal - high >= best[0]: continue
+            g = cands[i]
+            if not fits(g, chosen): continue
+            chosen.append(g)
+            search(i + 1, chosen, total + logs[i])
+            chosen.pop()
+
+    search(0, [], 0.0)
+    return best[1]
+
+def format_ticket(combo, target):
+    msg = f"🎫 <b>BILHETE DE OURO</b> 🎫\n🎯 Alvo: @{target:.2f} | {len(combo)} pernas\n\n"
+    total = 1.0
+    for g in sorted(combo, key=lambda g: g.kickoff):
+        total *= g.odd
+        msg += f"✅ <b>{safe_html(g.match)}</b>\n{safe_html(g.league)} | ⏰ {g.time}\n🎯 {g.pick} (@{g.odd:.2f})\n\n"
+    msg += f"🔥 <b>TOTAL: {total:.2f}</b>"
+    return msg
+
+async def ticket_message(target, legs):
+    if not TODAYS_GAMES: await fetch_shared("fut")
+    # Busca pesada em CPU: fora do event loop para não segurar o polling nem os outros handlers
+    combo = await asyncio.to_thread(build_accumulator, list(TODAYS_GAMES), target, legs)
+    if not combo: return "❌ Jogos seguros insuficientes para gerar a múltipla."
+    return format_ticket(combo, target)
+
+# --- 5.4 POLLERS EM PROCESSOS SEPARADOS (OPCIONAL, POLL_WORKERS > 0) ---
+# Cada worker é um processo com seu próprio event loop, cliente HTTP, descoberta e agenda adaptativa,
+# restrito ao seu shard de ligas. Ele só manda deltas compactos (tuplas dos jogos que mudaram + ids que sumiram)
+# por uma multiprocessing.Queue. O bot aplica os deltas em TODAYS_GAMES e roda o motor de eventos sozinho,
+# então a memória de alertas tem um dono só e não existe alerta duplicado, nem quando um worker reinicia.
+
+def shard_leagues(codes, n):
+    shards = [[] for _ in range(n)]
+    for code in sorted(codes): shards[zlib.crc32(code.encode()) % n].append(code)
+    return shards
+
+def poll_worker_main(wid, codes, out):
+    # Ponto de entrada do processo filho
+    try:
+        asyncio.run(poll_worker(wid, codes, out))
+    except KeyboardInterrupt:
+        pass
+
+async def poll_worker(wid, codes, out):
+    # SUPERVISOR zerado também vale para start method "fork", que herda o estado do bot
+    global SOCCER_LEAGUES, SUPERVISOR
+    SOCCER_LEAGUES = {code: SOCCER_LEAGUES[code] for code in codes}
+    SUPERVISOR = None
+    sent = {}          # gid -> tupla já enviada ao bot
+    versions = {}      # liga -> versão já enviada
+    active_sent = None
+    date_sent = ""
+    beat = asyncio.create_task(worker_heartbeat(wid, out))
+    while True:
         try:
-            feed = await asyncio.to_thread(feedparser.parse, "https://ge.globo.com/rss/ge/futebol/")
-            if feed.entries:
-                entry = feed.entries[0]
-                msg = f"🌍 <b>GIRO DE NOTÍCIAS</b>\n\n📰 {safe_html(entry.title)}\n🔗 {entry.link}"
-                await app.bot.send_message(CHANNEL_ID, msg, parse_mode=ParseMode.HTML)
-        except: pass
+            await poll_due()
+        except Exception as e:
+            logger.warning(f"Worker {wid}: falha no poll ({e!r:.160})")
+        date_str = get_api_date_str()
+        if date_str != date_sent:
+            sent.clear(); versions.clear(); date_sent = date_str   # dia novo: reenvia tudo
+        if ACTIVE_LEAGUES != active_sent:
+            out.send(("active", wid, sorted(ACTIVE_LEAGUES)))
+            active_sent = set(ACTIVE_LEAGUES)
+        for code in SOCCER_LEAGUES:
+            if LEAGUE_VERSIONS.get(code) == versions.get(code): continue
+            rows = [astuple(g) for g in TODAYS_GAMES if g.code == code]
+            ids = {row[0] for row in rows}
+            changed = [row for row in rows if sent.get(row[0]) != row]
+            gone = [gid for gid, row in sent.items() if row[1] == code and gid not in ids]
+            if changed or gone: out.send(("delta", wid, code, date_str, changed, gone))
+            for row in changed: sent[row[0]] = row
+            for gid in gone: sent.pop(gid)
+            versions[code] = LEAGUE_VERSIONS.get(code)
+        await asyncio.sleep(min(seconds_until_next_poll(get_real_server_date()), WORKER_HEARTBEAT))
+
+async def worker_heartbeat(wid, out):
+    # Task própria: uma descoberta lenta (ESPN em timeout) não pode parecer worker travado
+    # Leva o último poll OK e o maior intervalo da agenda: o supervisor vê se o polling anda, não só o loop
+    while True:
+        max_interval = max((e["interval"] for e in POLL_SCHEDULE.values()), default=None)
+        out.send(("beat", wid, LAST_POLL_OK, max_interval))
+        await asyncio.sleep(WORKER_HEARTBEAT)
+
+def apply_delta(code, date_str, changed, gone):
+    global TODAYS_GAMES, SOCCER_DATE
+    if date_str < SOCCER_DATE: return False   # resto do dia anterior chegando atrasado
+    keep = TODAYS_GAMES if date_str == SOCCER_DATE else []
+    by_id = {g.id: g for g in keep}
+    for gid in gone: by_id.pop(gid, None)
+    for row in changed: by_id[row[0]] = SoccerGame(*row)
+    TODAYS_GAMES = sorted(by_id.values(), key=lambda g: g.kickoff)
+    SOCCER_DATE = date_str
+    LEAGUE_VERSIONS[code] = LEAGUE_VERSIONS.get(code, 0) + 1
+    return True
+
+class PollSupervisor:
+    # Um Pipe por worker, recriado a cada restart: matar um processo no meio de um send pode deixar o canal
+    # corrompido (lock preso ou frame pela metade), e isso não pode contaminar os outros workers
+    def __init__(self, n):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.shards = [codes for codes in shard_leagues(SOCCER_LEAGUES, n) if codes]
+        self.workers = {}   # wid -> {"proc", "conn", "beat", "started", "restarts", "last_ok", "max_interval"}
+        self.active = {}    # wid -> ligas ativas do shard
+        self.stats = {"deltas": 0, "restarts": 0}
+
+    def spawn(self, wid):
+        recv, send = self.ctx.Pipe(duplex=False)
+        proc = self.ctx.Process(target=poll_worker_main, args=(wid, self.shards[wid], send), name=f"poller-{wid}", daemon=True)
+        proc.start()
+        send.close()   # só o filho escreve: com ele morto, o recv dá EOF em vez de travar
+        w = self.workers.setdefault(wid, {"restarts": 0})
+        w.update(proc=proc, conn=recv, beat=time.time(), started=time.time(), last_ok=0.0, max_interval=None)
+        print(f"🧵 [WORKER {wid}] pid {proc.pid} | {len(self.shards[wid])} ligas")
+
+    def stalled(self, w, now):
+        if w["max_interval"] is None: return False   # shard sem liga ativa: nada a buscar
+        return now - max(w["last_ok"], w["started"]) > w["max_interval"] + WORKER_STALL_GRACE
+
+    def reap(self, w):
+        proc = w["proc"]
+        if proc.is_alive():
+            proc.terminate(); proc.join(5)
+            if proc.is_alive(): proc.kill(); proc.join(5)
+        if w["conn"] is not None: w["conn"].close()
+
+    def supervise(self):
+        now = time.time()
+        for wid, w in self.workers.items():
+            proc = w["proc"]
+            if w["conn"] is not None and proc.is_alive() and now - w["beat"] <= WORKER_TIMEOUT and not self.stalled(w, now): continue
+            # Backoff: worker que morre em loop não é reiniciado mais de uma vez a cada 2^n s (teto 5 min)
+            if now - w["started"] < min(300, 2 ** w["restarts"]): continue
+            if w["conn"] is None or not proc.is_alive(): reason = "morreu ou fechou o canal"
+            elif now - w["beat"] > WORKER_TIMEOUT: reason = "sem heartbeat"
+            else: reason = "sem progresso no polling"
+            logger.warning(f"Worker {wid} {reason} (exit {proc.exitcode}); reiniciando")
+            self.reap(w)
+            w["restarts"] += 1; self.stats["restarts"] += 1
+            self.spawn(wid)
+
+    def handle(self, msg):
+        global ACTIVE_LEAGUES, LAST_POLL_OK
+        kind, wid = msg[0], msg[1]
+        w = self.workers.get(wid)
+        if w: w["beat"] = time.time()
+        if kind == "delta":
+            self.stats["deltas"] += 1
+            return apply_delta(*msg[2:])
+        if kind == "active":
+            self.active[wid] = set(msg[2])
+            ACTIVE_LEAGUES = set().union(*self.active.values())
+            DISCOVERY.update(date=get_api_date_str(), at=time.time())   # vale para o /readyz em dia sem jogo
+        elif kind == "beat":
+            LAST_POLL_OK = max(LAST_POLL_OK, msg[2])
+            if w: w["last_ok"], w["max_interval"] = msg[2], msg[3]
+        return False
+
+    def drain(self, timeout):
+        # Bloqueia (numa thread) até algum pipe ter dado e junta tudo que estiver pronto num lote só.
+        # Pipe com EOF/lixo (worker morto no meio do send) é marcado com conn=None e o supervise reinicia
+        conns = {w["conn"]: w for w in self.workers.values() if w["conn"] is not None}
+        batch = []
+        for conn in multiprocessing.connection.wait(list(conns), timeout):
+            try:
+                while conn.poll() and len(batch) < 1000: batch.append(conn.recv())
+            except Exception:
+                conn.close(); conns[conn]["conn"] = None
+        return batch
+
+    async def run(self):
+        print(f"🤖 MASTER LOOP: {len(self.shards)} workers de polling")
+        for wid in range(len(self.shards)): self.spawn(wid)
+        processed = {}
+        while True:
+            try:
+                # drain e supervise nunca rodam juntos: pipes só são fechados/recriados fora da thread
+                batch = await asyncio.to_thread(self.drain, 1.0)
+                if any([self.handle(msg) for msg in batch]): await run_engine(processed)
+                self.supervise()
+            except Exception as e:
+                print(f"⚠️ ERRO NO MASTER LOOP: {e}")
+
+    def stop(self):
+        for w in self.workers.values():
+            if w["proc"].is_alive(): w["proc"].terminate()
+        for w in self.workers.values():
+            w["proc"].join(5)
+            if w["conn"] is not None: w["conn"].close()
 
 # --- 6. MENU INTERATIVO ---
 
@@ -365,66 +1735,184 @@ async def start(u: Update, c: ContextTypes.DEFAULT_TYPE):
     ]
     await u.message.reply_text("🦁 <b>PAINEL V337 (SISTEMA CONTÁBIL ATIVO)</b>\nControle de Green/Red 100% operante.", reply_markup=InlineKeyboardMarkup(botoes), parse_mode=ParseMode.HTML)
 
-async def menu(u: Update, c: ContextTypes.DEFAULT_TYPE):
-    q = u.callback_query; await q.answer()
-    
-    if q.data == "fut":
-        await q.message.reply_text("🔄 Buscando jogos na ESPN...")
-        await fetch_espn_soccer()
-        if not TODAYS_GAMES:
-            await q.message.reply_text("❌ Sem jogos hoje.")
+async def can_manage(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    # Em grupo só admin mexe na assinatura; no privado o próprio usuário manda
+    chat = u.effective_chat
+    if chat.type == "private": return True
+    member = await c.bot.get_chat_member(chat.id, u.effective_user.id)
+    return member.status in ("administrator", "creator")
+
+async def cmd_assinar(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    # /assinar [ligas...]  (sem ligas = todas)
+    if not await can_manage(u, c):
+        await u.message.reply_text("❌ Só admins do grupo podem mudar a assinatura.")
+        return
+    leagues = {a.lower() for a in c.args}
+    invalid = leagues - league_codes()
+    if invalid:
+        await u.message.reply_text(f"❌ Liga(s) desconhecida(s): {', '.join(sorted(invalid))}\nUse /ligas para ver a lista.")
+        return
+    chat_id = str(u.effective_chat.id)
+    old = REGISTRY.get(chat_id)
+    sub = Subscriber(chat_id, frozenset(leagues), old.times if old else {})
+    REGISTRY.set(sub)
+    await STORE.save_subscription(chat_id, sub.leagues, sub.times)
+    schedule_subscriber(c.job_queue, sub, catch_up=False)
+    alvo = ", ".join(sorted(sub.leagues)) if sub.leagues else "todas as ligas"
+    await u.message.reply_text(f"✅ Assinatura ativa: <b>{safe_html(alvo)}</b>", parse_mode=ParseMode.HTML)
+
+async def cmd_horarios(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    # /horarios grade_manha=09:00 fechamento=23:30
+    sub = REGISTRY.get(str(u.effective_chat.id))
+    if sub is None or not await can_manage(u, c):
+        await u.message.reply_text("❌ Assine primeiro com /assinar (só admins).")
+        return
+    times = dict(sub.times)
+    for arg in c.args:
+        name, _, value = arg.partition("=")
+        parsed = parse_hhmm(value)
+        if name not in BROADCAST_JOBS or not parsed:
+            await u.message.reply_text(f"❌ Formato: /horarios {' '.join(f'{n}=HH:MM' for n in BROADCAST_JOBS)}")
             return
-        txt = f"🦁 <b>GRADE VIP | {get_display_date()}</b> 🦁\n\n"
-        for g in TODAYS_GAMES:
-            card = format_card(g, g['raw'])
-            if len(txt)+len(card) > 4000:
-                await c.bot.send_message(q.message.chat_id, txt, parse_mode=ParseMode.HTML); txt = ""
-            txt += card
-        if txt: await c.bot.send_message(q.message.chat_id, txt, parse_mode=ParseMode.HTML)
-        await q.message.delete()
-
-    elif q.data == "ufc":
-        await q.message.reply_text("🔄 Buscando Lutas...")
-        await fetch_espn_ufc()
-        if not TODAYS_UFC:
-            await q.message.reply_text("❌ Sem UFC hoje.")
+        times[name] = f"{parsed[0]:02d}:{parsed[1]:02d}"
+    sub = Subscriber(sub.chat_id, sub.leagues, times)
+    REGISTRY.set(sub)
+    await STORE.save_subscription(sub.chat_id, sub.leagues, sub.times)
+    schedule_subscriber(c.job_queue, sub, catch_up=False)
+    resumo = "\n".join(f"• {n}: {h:02d}:{m:02d}" for n in BROADCAST_JOBS for h, m in [broadcast_time(sub, n)])
+    await u.message.reply_text(f"⏰ <b>Horários deste chat</b>\n{resumo}", parse_mode=ParseMode.HTML)
+
+async def cmd_sair(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    if not await can_manage(u, c):
+        await u.message.reply_text("❌ Só admins do grupo podem mudar a assinatura.")
+        return
+    chat_id = str(u.effective_chat.id)
+    REGISTRY.remove(chat_id)
+    unschedule_subscriber(c.job_queue, chat_id)
+    await STORE.delete_subscription(chat_id)
+    await u.message.reply_text("👋 Assinatura cancelada. Nenhum alerta será enviado aqui.")
+
+async def cmd_ligas(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    # 🟢 = tem jogo hoje (descoberta do dia)
+    linhas = [f"{'🟢' if code in ACTIVE_LEAGUES else '⚪'} <code>{code}</code> {safe_html(name)}" for code, name in SOCCER_LEAGUES.items()]
+    linhas += ["<code>nba</code> 🏀 NBA", "<code>ufc</code> 🥊 UFC"]
+    await u.message.reply_text("📋 <b>Ligas disponíveis</b>\n" + "\n".join(linhas) + "\n\nEx: /assinar bra.1 eng.1 nba", parse_mode=ParseMode.HTML)
+
+def history_line(label, green, red, profit):
+    total = green + red
+    return f"{label}: {green}G/{red}R | {round(green / total * 100, 1)}% | ROI {round(profit / total * 100, 1):+}%"
+
+async def history_report(days):
+    since = (get_real_server_date() - timedelta(days=days - 1)).strftime("%Y%m%d")
+    by_league, by_band = await asyncio.to_thread(STORE.pick_summary, since)
+    if not by_league: return None
+    green = sum(r[1] for r in by_league); red = sum(r[2] for r in by_league); profit = sum(r[3] for r in by_league)
+    linhas = [f"📚 <b>HISTÓRICO | ÚLTIMOS {days} DIAS</b>\n", f"📈 <b>{history_line('Geral', green, red, profit)}</b>\n", "🏆 <b>Por liga</b>"]
+    for league, g, r, p in sorted(by_league, key=lambda row: -(row[1] + row[2])):
+        linhas.append("• " + history_line(safe_html(SOCCER_LEAGUES.get(league, league)), g, r, p))
+    linhas.append("\n🎲 <b>Por faixa de odd</b>")
+    order = [label for _, label in reversed(ODD_BANDS)]
+    for band, g, r, p in sorted(by_band, key=lambda row: order.index(row[0])):
+        linhas.append("• " + history_line(band, g, r, p))
+    return "\n".join(linhas)
+
+async def cmd_bilhete(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    # /bilhete [alvo] [pernas]  ex: /bilhete 5.00 4
+    try:
+        target = float(c.args[0].lstrip("@").replace(",", ".")) if c.args else TICKET_DEFAULT_TARGET
+        legs = int(c.args[1]) if len(c.args) > 1 else TICKET_DEFAULT_LEGS
+    except ValueError:
+        target = legs = 0
+    if not (1.0 < target <= 1000 and 1 <= legs <= 8):
+        await u.message.reply_text("❌ Formato: /bilhete 5.00 4  (alvo > 1.00, de 1 a 8 pernas)")
+        return
+    await u.message.reply_text(await ticket_message(target, legs), parse_mode=ParseMode.HTML)
+
+async def cmd_historico(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    # /historico [dias]  (padrão 30)
+    try:
+        days = max(1, min(int(c.args[0]), 3650)) if c.args else 30
+    except ValueError:
+        await u.message.reply_text("❌ Formato: /historico 7")
+        return
+    msg = await history_report(days)
+    await u.message.reply_text(msg or f"ℹ️ Nenhuma aposta liquidada nos últimos {days} dias.", parse_mode=ParseMode.HTML)
+
+# botão -> (aviso de busca, aviso de vazio, cabeçalho)
+MENU_GRIDS = {
+    "fut": ("🔄 Buscando jogos na ESPN...", "❌ Sem jogos hoje.", lambda: f"🦁 <b>GRADE VIP | {get_display_date()}</b> 🦁\n\n"),
+    "ufc": ("🔄 Buscando Lutas...", "❌ Sem UFC hoje.", lambda: "🥊 <b>CARD UFC</b>\n\n"),
+    "nba": ("🔄 Buscando NBA...", "❌ Sem NBA na API.", lambda: f"🏀 <b>NBA | {get_display_date()}</b>\n\n"),
+}
+
+class MenuGate:
+    # Na frente do CallbackQueryHandler: cooldown por chat/botão, um pedido em andamento por usuário em cada chat
+    # (clique novo do mesmo usuário cancela o anterior; em grupo um não cancela o outro) e latência por botão
+    def __init__(self):
+        self.inflight = {}
+        self.last_click = {}
+        self.latency = {}
+
+    async def handle(self, u: Update, c: ContextTypes.DEFAULT_TYPE, handler):
+        q = u.callback_query
+        chat_id = q.message.chat_id
+        key = (chat_id, q.data)
+        now = time.monotonic()
+        if now - self.last_click.get(key, float("-inf")) < MENU_COOLDOWN:
+            await q.answer("⏳ Calma! Já estou buscando.")
             return
-        txt = "🥊 <b>CARD UFC</b>\n\n"
-        for f in TODAYS_UFC: txt += format_ufc_card(f)
-        await c.bot.send_message(q.message.chat_id, txt, parse_mode=ParseMode.HTML)
-        await q.message.delete()
-
-    elif q.data == "nba":
-        await q.message.reply_text("🔄 Buscando NBA...")
-        await fetch_espn_nba()
-        if not TODAYS_NBA:
-            await q.message.reply_text("❌ Sem NBA na API.")
+        await q.answer()
+        self.last_click[key] = now
+        if len(self.last_click) > 10000:
+            self.last_click = {k: t for k, t in self.last_click.items() if now - t < MENU_COOLDOWN}
+
+        owner = (chat_id, q.from_user.id)
+        previous = self.inflight.get(owner)
+        if previous and not previous.done(): previous.cancel()
+        self.inflight[owner] = c.application.create_task(self._run(u, c, handler, q.data, now, owner))
+
+    async def _run(self, u, c, handler, data, started, owner):
+        try:
+            await handler(u, c)
+        except asyncio.CancelledError:
             return
-        txt = f"🏀 <b>NBA | {get_display_date()}</b>\n\n"
-        for g in TODAYS_NBA: txt += format_nba_card(g)
-        await c.bot.send_message(q.message.chat_id, txt, parse_mode=ParseMode.HTML)
-        await q.message.delete()
+        finally:
+            if self.inflight.get(owner) is asyncio.current_task():
+                del self.inflight[owner]
+        self.latency.setdefault(data, LatencyRecorder()).record(time.monotonic() - started)
+
+MENU_GATE = MenuGate()
+
+async def menu(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    await MENU_GATE.handle(u, c, handle_menu)
+
+async def handle_menu(u: Update, c: ContextTypes.DEFAULT_TYPE):
+    q = u.callback_query
+    
+    if q.data in ("fut", "ufc", "nba"):
+        loading, empty, header = MENU_GRIDS[q.data]
+        loading_msg = None if is_fresh(q.data) else await q.message.reply_text(loading)
+        try:
+            await fetch_shared(q.data)
+        except asyncio.CancelledError:
+            # Cancelado por clique novo do mesmo usuário: não deixa o "Buscando..." órfão no chat
+            if loading_msg:
+                try: await loading_msg.delete()
+                except Exception: pass
+            raise
+        pages = rendered_pages(q.data, header())
+        if not pages:
+            await q.message.reply_text(empty)
+            return
+
+        async def send_pages():
+            for page in pages: await c.bot.send_message(q.message.chat_id, page, parse_mode=ParseMode.HTML)
+            await q.message.delete()
+        # Começou a mandar a grade, termina: cancelamento no meio deixaria o usuário com meia grade
+        await asyncio.shield(send_pages())
         
     elif q.data == "ticket":
-        if not TODAYS_GAMES: await fetch_espn_soccer()
-        cands = [g for g in TODAYS_GAMES if g['status'] != 'post']
-        valid = []
-        for g in cands:
-            odds_list = g['raw']['competitions'][0].get('odds', [])
-            d = odds_list[0].get('details', '-') if odds_list else '-'
-            p, o, _, fav = parse_odds_string(d, g['home'], g['away'])
-            if fav and 1.20 <= o <= 2.20: valid.append({'m': g['match'], 'p': p, 'o': o})
-        
-        if len(valid) < 2:
-            await q.message.reply_text("❌ Jogos seguros insuficientes para gerar a múltipla.")
-            return
-        random.shuffle(valid)
-        msg = "🎫 <b>BILHETE DE OURO</b> 🎫\n\n"
-        t = 1.0
-        for v in valid[:3]:
-            t *= v['o']
-            msg += f"✅ <b>{v['m']}</b>\n🎯 {v['p']} (@{v['o']:.2f})\n\n"
-        msg += f"🔥 <b>TOTAL: {t:.2f}</b>"
+        msg = await ticket_message(TICKET_DEFAULT_TARGET, TICKET_DEFAULT_LEGS)
         await c.bot.send_message(q.message.chat_id, msg, parse_mode=ParseMode.HTML)
 
     elif q.data == "relatorio":
@@ -442,23 +1930,164 @@ async def menu(u: Update, c: ContextTypes.DEFAULT_TYPE):
                 f"❌ <b>REDS:</b> {r_count}\n"
                 f"📈 <b>Taxa de Acerto:</b> {win_rate}%\n"
             )
+            semana = await history_report(7)
+            if semana: relatorio += "\n" + semana
             await c.bot.send_message(q.message.chat_id, relatorio, parse_mode=ParseMode.HTML)
 
-# --- SERVER ---
-class Handler(BaseHTTPRequestHandler):
-    def do_GET(self): self.send_response(200); self.wfile.write(b"ONLINE V337")
-def run_server(): HTTPServer(("0.0.0.0", PORT), Handler).serve_forever()
+# --- SERVER (health + métricas, no mesmo event loop do bot) ---
+
+async def monitor_loop_lag(interval=1.0):
+    global LOOP_LAG
+    while True:
+        t0 = time.monotonic()
+        await asyncio.sleep(interval)
+        LOOP_LAG = max(0.0, time.monotonic() - t0 - interval)
+
+def health_status():
+    now_ts = time.time()
+    dead = [name for name, task in BACKGROUND_TASKS.items() if task.done()]
+    poll_age = now_ts - LAST_POLL_OK if LAST_POLL_OK else None
+    # Dia sem jogo: a descoberta de hoje não achou liga ativa, então não há poll a fazer até a próxima descoberta
+    idle_day = not ACTIVE_LEAGUES and DISCOVERY["date"] == get_api_date_str()
+    checks = {
+        "loops_alive": not dead,
+        "poll_recent": idle_day or (poll_age is not None and poll_age <= READY_MAX_POLL_AGE),
+        "loop_lag_ok": LOOP_LAG <= READY_MAX_LOOP_LAG,
+        "send_queue_ok": OUTBOX.depth() < SEND_QUEUE_MAX * 0.9,
+    }
+    return {
+        "version": "V337", "uptime_s": round(now_ts - STARTED_AT),
+        "last_poll_age_s": None if poll_age is None else round(poll_age, 1),
+        "loop_lag_s": round(LOOP_LAG, 4), "send_queue_depth": OUTBOX.depth(),
+        "dead_loops": dead, "checks": checks,
+    }
+
+def prom_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def prom_summary(lines, name, help_text, recorders, label):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} summary")
+    for key, rec in recorders.items():
+        lbl = f'{label}="{prom_escape(key)}"'
+        for p, v in rec.percentiles().items():
+            lines.append(f'{name}{{{lbl},quantile="{p / 100}"}} {v:.6f}')
+        lines.append(f"{name}_sum{{{lbl}}} {rec.total:.6f}")
+        lines.append(f"{name}_count{{{lbl}}} {rec.count}")
+
+def prom_family(lines, name, kind, help_text, samples):
+    # samples: [(labels_dict, valor)]
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lbl = ",".join(f'{k}="{prom_escape(v)}"' for k, v in labels.items())
+        lines.append(f"{name}{{{lbl}}} {value}" if lbl else f"{name} {value}")
+
+def render_metrics():
+    lines = []
+    prom_summary(lines, "espn_fetch_seconds", "Latência das buscas na ESPN.", FETCH_LATENCY, "league")
+    prom_summary(lines, "espn_parse_seconds", "Tempo de parse do placar (só em cache miss).", PARSE_LATENCY, "league")
+    prom_family(lines, "espn_fetch_errors_total", "counter", "Buscas na ESPN que falharam.", [({"league": k}, v) for k, v in FETCH_ERRORS.items()])
+    prom_family(lines, "espn_cache_hits_total", "counter", "Respostas servidas pelo cache condicional.", [({"url": k}, v["hit"]) for k, v in CACHE_STATS.items()])
+    prom_family(lines, "espn_cache_misses_total", "counter", "Respostas baixadas e parseadas de novo.", [({"url": k}, v["miss"]) for k, v in CACHE_STATS.items()])
+    prom_family(lines, "poll_interval_seconds", "gauge", "Intervalo de polling atual por liga.", [({"league": k, "state": v["state"]}, v["interval"]) for k, v in POLL_SCHEDULE.items()])
+    prom_family(lines, "last_poll_age_seconds", "gauge", "Idade do último poll bem-sucedido.", [({}, round(time.time() - LAST_POLL_OK, 1) if LAST_POLL_OK else -1)])
+    prom_family(lines, "event_loop_lag_seconds", "gauge", "Atraso do event loop.", [({}, round(LOOP_LAG, 6))])
+    prom_family(lines, "games_tracked", "gauge", "Jogos na grade e na memória de alertas.", [({"set": "today"}, len(TODAYS_GAMES)), ({"set": "alert_memory"}, len(ALERT_MEMORY))])
+    prom_family(lines, "events_emitted_total", "counter", "Eventos gerados pelo motor de diffs.", [({"kind": k}, v) for k, v in EVENTS_EMITTED.items()])
+    prom_family(lines, "daily_results", "gauge", "Greens e reds do dia.", [({"result": "green"}, DAILY_STATS["green"]), ({"result": "red"}, DAILY_STATS["red"])])
+    prom_family(lines, "espn_active_leagues", "gauge", "Ligas com jogo hoje (no polling).", [({}, len(ACTIVE_LEAGUES))])
+    prom_family(lines, "espn_catalogue_leagues", "gauge", "Ligas no catálogo.", [({}, len(SOCCER_LEAGUES))])
+    if SUPERVISOR:
+        prom_family(lines, "poll_worker_up", "gauge", "Worker de polling vivo.", [({"worker": wid}, int(w["proc"].is_alive())) for wid, w in SUPERVISOR.workers.items()])
+        prom_family(lines, "poll_worker_restarts_total", "counter", "Reinícios de workers de polling.", [({"worker": wid}, w["restarts"]) for wid, w in SUPERVISOR.workers.items()])
+        prom_family(lines, "poll_worker_deltas_total", "counter", "Deltas recebidos dos workers.", [({}, SUPERVISOR.stats["deltas"])])
+    prom_family(lines, "subscribers", "gauge", "Chats assinantes.", [({}, len(REGISTRY.subs))])
+    prom_family(lines, "telegram_send_queue_depth", "gauge", "Mensagens esperando na fila de envio.", [({}, OUTBOX.depth())])
+    prom_family(lines, "telegram_messages_total", "counter", "Fila de envio por desfecho.", [({"outcome": k}, v) for k, v in OUTBOX.stats.items()])
+    prom_summary(lines, "telegram_send_seconds", "Tempo da entrada na fila até o envio.", {"channel": OUTBOX.latency}, "queue")
+    prom_summary(lines, "menu_handler_seconds", "Latência dos botões do menu.", MENU_GATE.latency, "button")
+    prom_family(lines, "render_cache_total", "counter", "Cache de páginas renderizadas.", [({"outcome": k}, v) for k, v in RENDER_STATS.items()])
+    return "\n".join(lines) + "\n"
+
+def route_http(path):
+    if path in ("/", "/healthz"):
+        health = health_status()
+        ok = health["checks"]["loops_alive"]
+        body = "ONLINE V337" if path == "/" and ok else json.dumps(health)
+        return ("200 OK" if ok else "503 Service Unavailable"), body, "text/plain; charset=utf-8" if path == "/" else "application/json"
+    if path == "/readyz":
+        health = health_status()
+        ok = all(health["checks"].values())
+        return ("200 OK" if ok else "503 Service Unavailable"), json.dumps(health), "application/json"
+    if path == "/metrics":
+        return "200 OK", render_metrics(), "text/plain; version=0.0.4; charset=utf-8"
+    return "404 Not Found", "not found", "text/plain; charset=utf-8"
+
+async def handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        parts = request_line.decode("latin-1").split()
+        method = parts[0] if parts else "GET"
+        path = parts[1].split("?")[0] if len(parts) > 1 else "/"
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""): pass
+        status, body, ctype = route_http(path)
+        payload = body.encode()
+        head = f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n"
+        writer.write(head.encode() + (b"" if method == "HEAD" else payload))
+        await writer.drain()
+    except Exception: pass
+    finally:
+        writer.close()
+
+async def start_http_server():
+    server = await asyncio.start_server(handle_http, "0.0.0.0", PORT)
+    print(f"🌐 Health/métricas em :{PORT} (/healthz, /readyz, /metrics)")
+    return server
 
 async def post_init(app: Application):
+    global ALERT_MEMORY, DAILY_STATS, BROADCASTS_SENT, ACTIVE_LEAGUES, SUPERVISOR
     print("🚀 BOT V337 INICIADO! CONTABILIDADE ATIVA.")
-    asyncio.create_task(master_automation_loop(app))
-    asyncio.create_task(news_loop(app))
+    t0 = time.perf_counter()
+    STORE.open()
+    ALERT_MEMORY, DAILY_STATS, BROADCASTS_SENT = STORE.load(get_api_date_str())
+    print(f"💾 Estado restaurado: {len(ALERT_MEMORY)} jogos em memória, {DAILY_STATS['green']}G/{DAILY_STATS['red']}R hoje ({(time.perf_counter()-t0)*1000:.0f} ms)")
+    # Reinício no mesmo dia reaproveita a descoberta (só ligas do catálogo atual)
+    discovered = STORE.load_discovery(get_api_date_str())
+    if discovered:
+        ACTIVE_LEAGUES = discovered[0] & SOCCER_LEAGUES.keys()
+        DISCOVERY.update(date=get_api_date_str(), at=discovered[1])
+    app.bot_data["http_server"] = await start_http_server()
+    load_subscriptions()
+    OUTBOX.start(app.bot)
+    schedule_broadcasts(app)
+    if POLL_WORKERS > 0:
+        SUPERVISOR = PollSupervisor(POLL_WORKERS)
+        BACKGROUND_TASKS["master_loop"] = asyncio.create_task(SUPERVISOR.run())
+    else:
+        BACKGROUND_TASKS["master_loop"] = asyncio.create_task(master_automation_loop(app))
+    BACKGROUND_TASKS["news_loop"] = asyncio.create_task(news_loop(app))
+    BACKGROUND_TASKS["lag_monitor"] = asyncio.create_task(monitor_loop_lag())
+
+async def post_shutdown(app: Application):
+    server = app.bot_data.pop("http_server", None)
+    if server: server.close()
+    if SUPERVISOR: SUPERVISOR.stop()
+    await OUTBOX.stop()
+    await close_http_client()
+    await STORE.flush(ALERT_MEMORY, DAILY_STATS)
+    STORE.close()
 
 def main():
-    threading.Thread(target=run_server, daemon=True).start()
     defaults = Defaults(parse_mode=ParseMode.HTML)
-    app = Application.builder().token(BOT_TOKEN).post_init(post_init).defaults(defaults).build()
+    app = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown).defaults(defaults).build()
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("assinar", cmd_assinar))
+    app.add_handler(CommandHandler("horarios", cmd_horarios))
+    app.add_handler(CommandHandler("sair", cmd_sair))
+    app.add_handler(CommandHandler("ligas", cmd_ligas))
+    app.add_handler(CommandHandler("historico", cmd_historico))
+    app.add_handler(CommandHandler("bilhete", cmd_bilhete))
     app.add_handler(CallbackQueryHandler(menu))
     app.run_polling(drop_pending_updates=True)
 